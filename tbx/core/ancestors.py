@@ -0,0 +1,115 @@
+import threading
+
+from django.core.cache import cache
+
+from wagtail.wagtailcore.models import Page
+
+from tbx.core.cache import bump_generation, make_key
+
+
+# Ancestor chains
+#
+# Breadcrumbs and section lookups need a few fields of each of a page's
+# ancestors. These are cached per ancestor, keyed by its treebeard path, so
+# the chain of any page is a single get_many() of its path prefixes, and
+# pages in the same section share entries. Entries are also kept for the
+# rest of the request, as the same chain is often needed several times
+# while rendering one page. The cache is invalidated whenever a page is
+# saved (which covers renames and moves) or published, and whenever a site
+# is saved or deleted, as entries hold the pages' URLs.
+
+_local = threading.local()
+
+
+def get_ancestor_paths(path):
+    return [path[:i] for i in range(Page.steplen, len(path), Page.steplen)]
+
+
+def _get_local_entries():
+    entries = getattr(_local, 'entries', None)
+    if entries is None:
+        entries = _local.entries = {}
+    return entries
+
+
+def clear_local_entries():
+    _local.__dict__.pop('entries', None)
+
+
+def make_entry(page):
+    return {
+        'id': page.pk,
+        'path': page.path,
+        'depth': page.depth,
+        'title': page.title,
+        'url_parts': page.get_url_parts(),
+        'content_type': page.content_type_id,
+        'show_in_play_menu': getattr(page, 'show_in_play_menu', False),
+    }
+
+
+def load_entries(paths):
+    """
+    Return a dict of {path: entry} for the pages with the given paths,
+    from the request's entries, the cache, or the database, in that order.
+    """
+    local_entries = _get_local_entries()
+    entries = dict(
+        (path, local_entries[path]) for path in paths if path in local_entries
+    )
+
+    missing = [path for path in paths if path not in entries]
+    if missing:
+        keys = dict((make_key('ancestors', path), path) for path in missing)
+        for key, entry in cache.get_many(keys.keys()).items():
+            entries[keys[key]] = entry
+
+        missing = [path for path in missing if path not in entries]
+        if missing:
+            # Specific pages are needed for 'show_in_play_menu', which costs
+            # a query per page type, but only until the entries are cached
+            loaded = dict(
+                (page.path, make_entry(page))
+                for page in Page.objects.filter(path__in=missing).specific()
+            )
+            cache.set_many(dict(
+                (make_key('ancestors', path), entry) for path, entry in loaded.items()
+            ), None)
+            entries.update(loaded)
+
+        local_entries.update(entries)
+    return entries
+
+
+def get_ancestor_entries(page, inclusive=False):
+    """
+    Return the cached entries for the ancestors of 'page', root first,
+    and 'page' itself as well if 'inclusive' is True. Each entry is a dict
+    of the page's id, path, depth, title, url_parts, content_type (id) and
+    show_in_play_menu. Callers record the entries they render as
+    dependencies.
+    """
+    paths = get_ancestor_paths(page.path)
+    if inclusive:
+        paths.append(page.path)
+
+    entries = load_entries(paths)
+    return [entries[path] for path in paths if path in entries]
+
+
+def get_entry_url(entry, current_site):
+    """
+    Return the URL of an entry's page, relative to 'current_site' like
+    Page.relative_url(), or None if the page isn't routable.
+    """
+    if entry['url_parts'] is None:
+        return
+    site_id, root_url, page_path = entry['url_parts']
+    if site_id == current_site.id:
+        return page_path
+    return root_url + page_path
+
+
+def invalidate_ancestors():
+    clear_local_entries()
+    bump_generation('ancestors')
@@ -5,3 +5,13 @@ class TorchboxCoreAppConfig(AppConfig):
     name = 'tbx.core'
     label = 'torchbox'
     verbose_name = "Torchbox"
+
+    def ready(self):
+        from tbx.core import signal_handlers  # noqa
+
+        # Register the template tags' cached results, so that they are
+        # invalidated by processes that haven't rendered a template yet
+        from tbx.core.templatetags import torchbox_tags  # noqa
+
+        from tbx.core.profiling import instrument_tags
+        instrument_tags()
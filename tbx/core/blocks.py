@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.db import models
+
+from wagtail.wagtailcore.blocks import (BaseStreamBlock, BaseStructBlock,
+                                        ListBlock, PageChooserBlock,
+                                        StreamValue, StructValue)
+from wagtail.wagtailcore.fields import StreamField
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailimages.blocks import ImageChooserBlock
+from wagtail.wagtailimages.models import get_image_model
+
+
+# Bulk loading of StreamField values
+#
+# Wagtail converts each chooser block in a stream into an object with its
+# own query, as the block is first accessed. BulkStreamValue instead walks
+# the raw stream data once, collects every page id referenced anywhere in
+# it (including inside StructBlocks, ListBlocks and nested StreamBlocks),
+# fetches them with one query per content type and fills the stream in.
+# Images referenced by ImageChooserBlocks are loaded the same way.
+#
+# This relies on StructBlock, ListBlock and StreamBlock keeping Wagtail's
+# standard to_python() behaviour, which all blocks in tbx.core.models do.
+
+def _chooser_type(block):
+    if isinstance(block, PageChooserBlock):
+        return 'page'
+    if isinstance(block, ImageChooserBlock):
+        return 'image'
+
+
+def collect_chooser_ids(block, raw_value, ids):
+    """
+    Add the ids referenced by chooser blocks within 'raw_value' to 'ids',
+    a dict of sets keyed by chooser type.
+    """
+    chooser_type = _chooser_type(block)
+    if chooser_type is not None:
+        if raw_value is not None and not isinstance(raw_value, models.Model):
+            ids[chooser_type].add(raw_value)
+    elif isinstance(block, BaseStructBlock):
+        for name, child_block in block.child_blocks.items():
+            if name in raw_value:
+                collect_chooser_ids(child_block, raw_value[name], ids)
+    elif isinstance(block, ListBlock):
+        for item in raw_value:
+            collect_chooser_ids(block.child_block, item, ids)
+    elif isinstance(block, BaseStreamBlock):
+        for item in raw_value:
+            child_block = block.child_blocks.get(item['type'])
+            if child_block is not None:
+                collect_chooser_ids(child_block, item['value'], ids)
+
+
+def load_choosers(ids):
+    """
+    Fetch the objects referenced by chooser blocks, returning a dict of
+    {chooser type: {id: object}}.
+    """
+    objects = {}
+    if ids.get('page'):
+        objects['page'] = {
+            page.pk: page
+            for page in Page.objects.filter(pk__in=ids['page']).specific()
+        }
+    if ids.get('image'):
+        objects['image'] = get_image_model().objects.in_bulk(ids['image'])
+    return objects
+
+
+def _to_python(block, raw_value, objects):
+    chooser_type = _chooser_type(block)
+    if chooser_type is not None:
+        if raw_value is None or isinstance(raw_value, models.Model):
+            return raw_value
+        return objects.get(chooser_type, {}).get(raw_value)
+    elif isinstance(block, BaseStructBlock):
+        return StructValue(block, [
+            (
+                name,
+                _to_python(child_block, raw_value[name], objects)
+                if name in raw_value else child_block.get_default()
+            )
+            for name, child_block in block.child_blocks.items()
+        ])
+    elif isinstance(block, ListBlock):
+        return [
+            _to_python(block.child_block, item, objects)
+            for item in raw_value
+        ]
+    elif isinstance(block, BaseStreamBlock):
+        value = block.to_python(raw_value)
+        _bind_stream(value, objects)
+        return value
+    else:
+        return block.to_python(raw_value)
+
+
+def _bind_stream(value, objects):
+    # Fill in the StreamValue's cache of bound blocks, which it otherwise
+    # populates one child at a time from __getitem__
+    for i, item in enumerate(value.stream_data):
+        child_block = value.stream_block.child_blocks[item['type']]
+        value._bound_blocks[i] = StreamValue.StreamChild(
+            child_block, _to_python(child_block, item['value'], objects)
+        )
+    value.is_bulk_loaded = True
+
+
+def bulk_load_stream(value):
+    """
+    Convert every child of a lazy StreamValue to its native value, fetching
+    all the pages and images it references in bulk.
+    """
+    if not value.is_lazy or getattr(value, 'is_bulk_loaded', False):
+        return
+
+    ids = defaultdict(set)
+    collect_chooser_ids(value.stream_block, value.stream_data, ids)
+    _bind_stream(value, load_choosers(ids))
+
+
+class BulkStreamValue(StreamValue):
+    def __getitem__(self, i):
+        bulk_load_stream(self)
+        return super(BulkStreamValue, self).__getitem__(i)
+
+
+class BulkStreamField(StreamField):
+    """
+    A StreamField whose values are bulk loaded the first time they are
+    accessed (see bulk_load_stream).
+    """
+    def to_python(self, value):
+        value = super(BulkStreamField, self).to_python(value)
+        if value.is_lazy and not isinstance(value, BulkStreamValue):
+            value = BulkStreamValue(
+                value.stream_block, value.stream_data, is_lazy=True,
+                raw_text=value.raw_text
+            )
+        return value
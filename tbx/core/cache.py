@@ -0,0 +1,177 @@
+import threading
+import uuid
+
+from collections import OrderedDict
+from functools import wraps
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db.models import Model
+from django.utils.encoding import force_bytes, force_text
+
+from tbx.core.dependencies import capture_dependencies, record, record_model
+
+
+# Generations
+#
+# Cached values that depend on content are stored under keys that include
+# a generation token. Bumping the generation invalidates every key built
+# from it at once, without having to know what those keys were. Tokens are
+# random so a generation evicted from the cache can't revive old keys.
+
+def generation_key(name):
+    return 'tbx:generation:%s' % name
+
+
+def get_generation(name):
+    key = generation_key(name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex[:12], None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(name):
+    cache.set(generation_key(name), uuid.uuid4().hex[:12], None)
+
+
+def make_key(name, *parts):
+    """
+    Build a cache key in the current generation of 'name'.
+    """
+    return ':'.join(
+        ['tbx', name, get_generation(name)] + [str(part) for part in parts]
+    )
+
+
+# Cached results
+#
+# cached_result() caches what a function returns, such as the ids of a
+# listing, under a key built from its arguments. The key also includes a
+# generation for each model the result depends on, which is bumped when a
+# page of that type is published, unpublished or deleted, or an instance
+# of another model is saved or deleted (see tbx.core.signal_handlers).
+#
+#     @cached_result('latest-blog-posts', models=[BlogPage], local_size=8)
+#     def get_latest_blog_post_ids(count):
+#         return list(BlogPage.objects.live().values_list('pk', flat=True)[:count])
+#
+# Results can also depend on other generations, such as 'play-paths' for
+# listings that leave out the Play section, named in 'generations'.
+#
+# The declared models are recorded as render dependencies on every call,
+# along with anything recorded while the result was computed, so pages
+# using a cached result are purged as if it had been computed for them.
+#
+# With 'local_size', the most recently used results are also kept in the
+# process, saving the fetch of the value itself. The generations are still
+# checked on every call, so both tiers are invalidated together.
+#
+# Models are registered for invalidation when a decorated function is
+# defined, so modules defining them are imported on startup (see
+# TorchboxCoreAppConfig.ready).
+
+_cached_models = set()
+
+_missing = object()
+
+
+def model_generation_name(model):
+    return 'model:%s' % model._meta.label_lower
+
+
+def get_generations(names):
+    keys = dict((generation_key(name), name) for name in names)
+    generations = dict(
+        (keys[key], generation) for key, generation in cache.get_many(keys.keys()).items()
+    )
+    for name in names:
+        if name not in generations:
+            generations[name] = get_generation(name)
+    return [generations[name] for name in names]
+
+
+def bump_model_generations(model):
+    """
+    Invalidate the cached results depending on 'model' or one of its
+    superclasses.
+    """
+    for cached_model in _cached_models:
+        if issubclass(model, cached_model):
+            bump_generation(model_generation_name(cached_model))
+
+
+def make_key_part(value):
+    if isinstance(value, Model):
+        return '%s.%s' % (value._meta.label_lower, value.pk)
+    return force_text(value)
+
+
+def make_args_key(args, kwargs):
+    parts = [make_key_part(value) for value in args]
+    parts.extend(
+        '%s=%s' % (name, make_key_part(value)) for name, value in sorted(kwargs.items())
+    )
+    return md5(force_bytes('|'.join(parts))).hexdigest()
+
+
+class LRUCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.pop(key, _missing)
+            if value is not _missing:
+                self.values[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = value
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+
+
+def cached_result(name, models, timeout=None, local_size=0, generations=()):
+    """
+    Cache the results of the decorated function until an instance of one of
+    'models' changes, one of 'generations' is bumped, or 'timeout' seconds
+    pass. Results must be picklable, so cache ids or plain values rather
+    than querysets.
+    """
+    _cached_models.update(models)
+    generation_names = [model_generation_name(model) for model in models]
+    generation_names.extend(generations)
+    local_cache = LRUCache(local_size) if local_size else None
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for model in models:
+                record_model(model)
+
+            key = ':'.join(
+                ['tbx', 'result', name] + get_generations(generation_names) +
+                [make_args_key(args, kwargs)]
+            )
+            cached = local_cache.get(key) if local_cache else _missing
+            if cached is _missing:
+                cached = cache.get(key, _missing)
+                if cached is _missing:
+                    with capture_dependencies() as dependencies:
+                        result = func(*args, **kwargs)
+                    cached = (result, dependencies)
+                    cache.set(key, cached, timeout)
+                if local_cache:
+                    local_cache.set(key, cached)
+
+            result, dependencies = cached
+            record(*dependencies)
+            return result
+        return wrapper
+    return decorator
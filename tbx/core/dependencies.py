@@ -0,0 +1,305 @@
+import logging
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.encoding import force_bytes, force_text
+from django.utils.six.moves.urllib.parse import urlparse
+
+from wagtail.contrib.settings.models import BaseSetting
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailimages.models import AbstractImage
+
+
+logger = logging.getLogger('tbx.dependencies')
+
+
+# Render dependencies
+#
+# While a page is rendered, what it shows is recorded as dependencies of its
+# URL, as strings like 'page:12'. Every image and setting instance loaded is
+# recorded (see record_instance), but pages only where they are rendered:
+# the page being served, linked pages, breadcrumbs and blog neighbours.
+# Listings whose contents change when any page of a type is published
+# record the type itself with record_model(). A reverse index in the cache
+# maps each dependency to the URLs that used it, so when something is
+# published only those URLs need purging from the frontend cache and the
+# page cache.
+
+_local = threading.local()
+
+
+def start_recording():
+    _local.dependencies = set()
+
+
+def stop_recording():
+    """
+    Stop recording and return the dependencies recorded, or None if
+    recording wasn't started.
+    """
+    return _local.__dict__.pop('dependencies', None)
+
+
+@contextmanager
+def capture_dependencies():
+    """
+    Record the dependencies of the enclosed block into a new set, which is
+    yielded, and add them to the recording in progress, if any.
+    """
+    outer = getattr(_local, 'dependencies', None)
+    captured = _local.dependencies = set()
+    try:
+        yield captured
+    finally:
+        if outer is None:
+            del _local.dependencies
+        else:
+            outer.update(captured)
+            _local.dependencies = outer
+
+
+def record(*dependencies):
+    recorded = getattr(_local, 'dependencies', None)
+    if recorded is not None:
+        recorded.update(dependencies)
+
+
+def model_dependency(model):
+    return 'model:%s' % model._meta.label_lower
+
+
+def record_model(model):
+    record(model_dependency(model))
+
+
+def instance_dependency(instance):
+    if isinstance(instance, Page):
+        return 'page:%s' % instance.pk
+    if isinstance(instance, AbstractImage):
+        return 'image:%s' % instance.pk
+    if isinstance(instance, BaseSetting):
+        return model_dependency(type(instance))
+
+
+def record_page(page):
+    if page is not None:
+        record('page:%s' % page.pk)
+
+
+def record_instance(instance):
+    # Called for every model instance created, so return early if nothing
+    # is being recorded. Pages are loaded for many reasons other than
+    # being shown (such as routing through the site root), so they're
+    # recorded with record_page() where they are rendered instead.
+    if getattr(_local, 'dependencies', None) is None or instance.pk is None:
+        return
+    if isinstance(instance, Page):
+        return
+    dependency = instance_dependency(instance)
+    if dependency is not None:
+        _local.dependencies.add(dependency)
+
+
+# Reverse index
+#
+# The index of a dependency maps the URLs that used it, as '<url> <page
+# cache key>', to when that was last recorded. With the Redis cache used in
+# production the index is a Redis hash, so concurrent renders each set
+# their own field; with other caches, updates are serialised with a lock.
+# Entries older than DEPENDENCY_INDEX_TIMEOUT are ignored and pruned, and
+# each URL records its dependencies again at least every half of that, so
+# URLs that no longer use a dependency drop out of its index in time.
+
+def _index_key(dependency):
+    return 'tbx:dependents:%s' % dependency
+
+
+def _url_key(url):
+    return 'tbx:dependencies:%s' % md5(force_bytes(url)).hexdigest()
+
+
+def _get_redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, AttributeError, NotImplementedError):
+        # Not using django-redis
+        return None
+
+
+@contextmanager
+def _index_lock(key, attempts=50):
+    """
+    Try to take the lock on an index, yielding whether it was taken. The
+    lock is only released by whoever took it.
+    """
+    lock_key = key + ':lock'
+    acquired = False
+    for attempt in range(attempts):
+        if cache.add(lock_key, True, 5):
+            acquired = True
+            break
+        time.sleep(0.01)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+def _add_to_indexes(dependencies, member, now):
+    """
+    Add 'member' to the indexes of 'dependencies'. Returns False if some
+    indexes were left unchanged because they couldn't be locked.
+    """
+    timeout = settings.DEPENDENCY_INDEX_TIMEOUT
+    redis = _get_redis()
+    if redis is not None:
+        pipe = redis.pipeline()
+        for dependency in dependencies:
+            key = cache.make_key(_index_key(dependency))
+            pipe.hset(key, member, int(now))
+            pipe.expire(key, timeout)
+        pipe.execute()
+
+        # Indexes of dependencies that are never purged are pruned now and
+        # again, so they don't grow with every URL ever rendered
+        if random.random() < 0.01:
+            _read_indexes(redis, dependencies, now)
+        return True
+
+    complete = True
+    for dependency in dependencies:
+        key = _index_key(dependency)
+        with _index_lock(key) as acquired:
+            if not acquired:
+                logger.warning("Couldn't lock the index of %s", dependency)
+                complete = False
+                continue
+            index = cache.get(key) or {}
+            index[member] = int(now)
+            cache.set(key, dict(
+                (member, saved_at) for member, saved_at in index.items()
+                if saved_at >= now - timeout
+            ), timeout)
+    return complete
+
+
+def _read_indexes(redis, dependencies, now):
+    """
+    Return the live members of the indexes of 'dependencies', pruning the
+    expired ones.
+    """
+    cutoff = now - settings.DEPENDENCY_INDEX_TIMEOUT
+    members = set()
+    if redis is not None:
+        keys = [cache.make_key(_index_key(dependency)) for dependency in dependencies]
+        pipe = redis.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        for key, index in zip(keys, pipe.execute()):
+            expired = [member for member, saved_at in index.items() if float(saved_at) < cutoff]
+            if expired:
+                redis.hdel(key, *expired)
+            members.update(
+                force_text(member) for member, saved_at in index.items()
+                if float(saved_at) >= cutoff
+            )
+    else:
+        indexes = cache.get_many([_index_key(dependency) for dependency in dependencies])
+        for index in indexes.values():
+            members.update(
+                member for member, saved_at in index.items() if saved_at >= cutoff
+            )
+    return members
+
+
+def save_dependencies(url, page_cache_key, dependencies):
+    """
+    Record that the page at 'url', cached in the page cache under
+    'page_cache_key', depends on 'dependencies'. The reverse index is only
+    written to when the dependencies of the URL have changed, or are due
+    to be refreshed.
+    """
+    url_key = _url_key(url)
+    now = time.time()
+    previous = cache.get(url_key)
+    if (
+        previous is not None and previous['dependencies'] == dependencies and
+        previous['saved_at'] > now - settings.DEPENDENCY_INDEX_TIMEOUT / 2
+    ):
+        return
+
+    if not _add_to_indexes(dependencies, '%s %s' % (url, page_cache_key), now):
+        # Try again the next time the URL is rendered
+        return
+    cache.set(url_key, {
+        'dependencies': dependencies,
+        'saved_at': now,
+    }, settings.DEPENDENCY_INDEX_TIMEOUT)
+
+
+def get_dependents(dependencies):
+    """
+    Return a dict of {url: page cache key} for every URL depending on any
+    of 'dependencies'.
+    """
+    members = _read_indexes(_get_redis(), list(dependencies), time.time())
+    return dict(member.split(' ', 1) for member in members)
+
+
+def purge_frontend_cache(urls):
+    """
+    Purge 'urls' from the frontend cache, if enabled, with a request per URL
+    and backend.
+    """
+    if 'wagtail.contrib.wagtailfrontendcache' not in settings.INSTALLED_APPS:
+        return
+
+    from wagtail.contrib.wagtailfrontendcache.utils import get_backends
+
+    backends = get_backends()
+    if not backends:
+        return
+
+    for url in sorted(urls):
+        for backend_name, backend in backends.items():
+            try:
+                backend.purge(url)
+            except Exception:
+                logger.exception("[%s] Error purging %s", backend_name, url)
+
+
+def purge_dependents(dependencies):
+    """
+    Once the current transaction has been committed, mark the URLs
+    depending on any of 'dependencies' stale in the page cache, remove their
+    pre-rendered copies and purge them from the frontend cache, if enabled.
+    This is done before the response to the change is sent, as work left to
+    a background thread may never run under uWSGI.
+    """
+    from tbx.core.middleware import expire_page_cache
+
+    def purge():
+        dependents = get_dependents(dependencies)
+        if not dependents:
+            return
+
+        expire_page_cache(dependents.values())
+
+        if settings.PRERENDER_ROOT:
+            from tbx.core.prerender import remove_path
+
+            for url in dependents:
+                remove_path(settings.PRERENDER_ROOT, urlparse(url).path)
+
+        purge_frontend_cache(list(dependents))
+
+    transaction.on_commit(purge)
@@ -1,23 +1,71 @@
-from datetime import datetime, time
+import hashlib
 
-import imghdr
+from datetime import datetime, time
 
 from django.conf import settings
 from django.contrib.syndication.views import Feed
-
-from tbx.core.models import BlogPage
-from tbx.core.utils import play_filter
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from tbx.core.cache import make_key
+from tbx.core.ical import ICalFeed, filter_events_by_date
+from tbx.core.models import BlogPage, EventPage
+
+
+class CachedFeed(Feed):
+    """
+    A Feed that caches its serialized output until a BlogPage is published
+    or unpublished (see tbx.core.signal_handlers). Responses carry a strong
+    ETag and a Last-Modified date taken from the newest item, and
+    conditional requests are answered from the cache alone.
+    """
+    def get_cache_key(self, request, *args, **kwargs):
+        # Item links include the host the feed was requested on
+        return make_key(
+            'feeds', self.__class__.__name__, request.get_host(), *args
+        )
+
+    def render(self, request, *args, **kwargs):
+        response = super(CachedFeed, self).__call__(request, *args, **kwargs)
+        return {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': hashlib.md5(response.content).hexdigest(),
+            'last_modified': parse_http_date_safe(response.get('Last-Modified', '')),
+        }
+
+    def __call__(self, request, *args, **kwargs):
+        key = self.get_cache_key(request, *args, **kwargs)
+        feed = cache.get(key)
+        if feed is None:
+            feed = self.render(request, *args, **kwargs)
+            cache.set(key, feed, None)
+
+        response = get_conditional_response(
+            request,
+            etag=feed['etag'],
+            last_modified=feed['last_modified'],
+        )
+        if response is None:
+            response = HttpResponse(feed['content'], content_type=feed['content_type'])
+
+        response['ETag'] = quote_etag(feed['etag'])
+        if feed['last_modified']:
+            response['Last-Modified'] = http_date(feed['last_modified'])
+        return response
 
 
 # Main blog feed
 
-class BlogFeed(Feed):
+class BlogFeed(CachedFeed):
     title = "The Torchbox Blog"
     link = "/blog/"
     description = "The latest news and views from Torchbox on the work we do, the web and the wider world"
 
     def items(self):
-        return play_filter(BlogPage.objects.live().order_by('-date'), 10)
+        return BlogPage.objects.live().not_in_play().order_by('-date')[:10]
 
     def item_title(self, item):
         return item.title
@@ -37,14 +85,14 @@ class BlogFeed(Feed):
 
 # Planet Drupal feed
 
-class PlanetDrupalFeed(Feed):
+class PlanetDrupalFeed(CachedFeed):
     title = "The Torchbox Planet Drupal Feed"
     link = "/blog/?tag=planet-drupal"
     description = "The Torchbox Planet Drupal Feed"
 
     def items(self):
         return BlogPage.objects.live().filter(tags__tag__slug='planet-drupal')\
-            .order_by('-date')
+            .select_related('feed_image').order_by('-date')[:10]
 
     def item_title(self, item):
         return item.title
@@ -64,9 +112,18 @@ class PlanetDrupalFeed(Feed):
 
     def item_enclosure_mime_type(self, item):
         if item.feed_image:
-            image_format = imghdr.what(item.feed_image.file)
-            return 'image/{}'.format(image_format)
+            return item.feed_image.mime_type
 
     def item_enclosure_length(self, item):
         if item.feed_image:
-            return item.feed_image.file.size
+            return item.feed_image.file_size
+
+
+# Events calendar
+
+class EventsFeed(ICalFeed):
+    filename = 'events.ics'
+
+    def items(self, start, end):
+        events = EventPage.objects.live().public().order_by('date_from', 'time_from', 'pk')
+        return filter_events_by_date(events, start, end)
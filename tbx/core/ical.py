@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+
+import hashlib
+
+from calendar import timegm
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Count, Max, Q
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import http_date, quote_etag
+
+
+CRLF = '\r\n'
+
+# RFC 5545 3.1: lines should not be longer than 75 octets, excluding the
+# line break. Continuation lines start with a single space.
+MAX_LINE_OCTETS = 75
+
+
+def escape_text(value):
+    """
+    Escape a TEXT property value (RFC 5545 3.3.11).
+    """
+    value = force_text(value or '')
+    return value.replace('\\', '\\\\')\
+        .replace(';', '\\;')\
+        .replace(',', '\\,')\
+        .replace('\r\n', '\\n')\
+        .replace('\n', '\\n')
+
+
+def fold_line(line):
+    """
+    Fold a content line into chunks of at most 75 octets, without splitting
+    a multi-byte UTF-8 character, and terminate it with CRLF.
+    """
+    encoded = force_bytes(line)
+    chunks = []
+    limit = MAX_LINE_OCTETS
+    while len(encoded) > limit:
+        end = limit
+        # Step back over UTF-8 continuation bytes (0b10xxxxxx)
+        while ord(encoded[end:end + 1]) & 0xC0 == 0x80:
+            end -= 1
+        chunks.append(encoded[:end])
+        encoded = encoded[end:]
+        limit = MAX_LINE_OCTETS - 1
+    chunks.append(encoded)
+    return force_text(b'\r\n '.join(chunks)) + CRLF
+
+
+def format_utc(value):
+    if timezone.is_aware(value):
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def make_local_aware(value, tz):
+    """
+    Make a naive local datetime aware. Times that are skipped or repeated
+    when the clocks change are taken as standard time rather than raising,
+    so one event can't break the whole feed.
+    """
+    return timezone.make_aware(value, tz, is_dst=False)
+
+
+def event_lines(event):
+    """
+    Yield the unfolded content lines of the VEVENTs for an event. Events
+    spanning several days produce one VEVENT per day.
+
+    Events are expected to have date_from, date_to, time_from, time_to,
+    title, url, search_description and location attributes. Pages are
+    linked by their full_url. Dates and times are in TIME_ZONE, and are
+    written in UTC so that no VTIMEZONE is needed.
+    """
+    tz = timezone.get_default_timezone()
+    url = getattr(event, 'full_url', None) or event.url or ''
+
+    # Work out number of days the event lasts
+    if event.date_to is not None:
+        days = (event.date_to - event.date_from).days + 1
+    else:
+        days = 1
+
+    start_time = event.time_from if event.time_from is not None else time.min
+    end_time = event.time_to if event.time_to is not None else time.max
+
+    stamp = getattr(event, 'latest_revision_created_at', None) or timezone.now()
+
+    for day in range(days):
+        day_date = event.date_from + timedelta(days=day)
+        start_datetime = datetime.combine(day_date, start_time)
+        end_datetime = datetime.combine(day_date, end_time)
+
+        uid = hashlib.sha1(
+            force_bytes(url + str(start_datetime))
+        ).hexdigest() + '@wagtaildemo'
+
+        yield 'BEGIN:VEVENT'
+        yield 'UID:' + uid
+        yield 'URL:' + url
+        yield 'DTSTAMP:' + format_utc(stamp)
+        yield 'SUMMARY:' + escape_text(event.title)
+        yield 'DESCRIPTION:' + escape_text(event.search_description)
+        yield 'LOCATION:' + escape_text(event.location)
+        yield 'DTSTART:' + format_utc(make_local_aware(start_datetime, tz))
+        yield 'DTEND:' + format_utc(make_local_aware(end_datetime, tz))
+        yield 'END:VEVENT'
+
+
+def iter_calendar(events):
+    """
+    Generate a VCALENDAR containing every event in 'events' as a stream of
+    folded, CRLF terminated lines. Events are only pulled from the iterable
+    as the output is consumed.
+    """
+    yield fold_line('BEGIN:VCALENDAR')
+    yield fold_line('VERSION:2.0')
+    yield fold_line('PRODID:-//Torchbox//wagtail//EN')
+
+    for event in events:
+        for line in event_lines(event):
+            yield fold_line(line)
+
+    yield fold_line('END:VCALENDAR')
+
+
+def filter_events_by_date(events, start, end):
+    """
+    Filter a queryset of events to those taking place on any day between
+    'start' and 'end' inclusive.
+    """
+    return events.filter(date_from__lte=end).filter(
+        Q(date_to__gte=start) | Q(date_to__isnull=True, date_from__gte=start)
+    )
+
+
+class ICalFeed(object):
+    """
+    A streaming iCalendar feed, used like django.contrib.syndication's Feed:
+    subclass it, implement items() and route an instance in urls.py (see
+    tbx.core.feeds.EventsFeed).
+
+    Clients can narrow the feed with ?from=YYYY-MM-DD&to=YYYY-MM-DD. The
+    response carries an ETag and Last-Modified header so polling calendar
+    clients get a 304 unless an event in the range has changed.
+    """
+    filename = 'calendar.ics'
+    default_range = timedelta(days=365)
+    max_range = timedelta(days=3 * 365)
+
+    def items(self, start, end):
+        """
+        Return a queryset of the events taking place between start and end,
+        usually by calling filter_events_by_date().
+        """
+        raise NotImplementedError
+
+    def get_date_range(self, request):
+        start = parse_date(request.GET.get('from', '')) or date.today()
+        end = parse_date(request.GET.get('to', '')) or start + self.default_range
+        if end < start or end - start > self.max_range:
+            raise ValueError("Invalid date range")
+        return start, end
+
+    def get_last_modified(self, items):
+        return items.aggregate(
+            last_modified=Max('latest_revision_created_at')
+        )['last_modified']
+
+    def get_etag(self, items, start, end, last_modified):
+        # The number of events is included so that unpublishing an event
+        # (which doesn't change the newest revision date) changes the ETag
+        count = items.aggregate(count=Count('pk'))['count']
+        key = '%s:%s:%s:%s' % (start, end, count, last_modified)
+        return hashlib.md5(force_bytes(key)).hexdigest()
+
+    def __call__(self, request, *args, **kwargs):
+        try:
+            start, end = self.get_date_range(request)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid date range")
+
+        items = self.items(start, end)
+        last_modified = self.get_last_modified(items)
+        last_modified_timestamp = last_modified and timegm(last_modified.utctimetuple())
+        etag = self.get_etag(items, start, end, last_modified)
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified_timestamp,
+        )
+        if response is None:
+            response = StreamingHttpResponse(
+                iter_calendar(items.iterator()),
+                content_type='text/calendar; charset=utf-8',
+            )
+            response['Content-Disposition'] = 'attachment; filename=%s' % self.filename
+
+        response['ETag'] = quote_etag(etag)
+        if last_modified_timestamp:
+            response['Last-Modified'] = http_date(last_modified_timestamp)
+        return response
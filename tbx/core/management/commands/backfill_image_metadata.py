@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from wagtail.wagtailimages.models import get_image_model
+
+
+class Command(BaseCommand):
+    help = "Record the MIME type and file size of images uploaded before they were stored"
+
+    def handle(self, **options):
+        images = get_image_model().objects.filter(
+            Q(mime_type='') | Q(file_size__isnull=True)
+        )
+
+        updated = 0
+        for image in images.iterator():
+            try:
+                image.update_file_metadata()
+            except (IOError, OSError):
+                self.stderr.write("Image file missing: id=%d %s" % (image.pk, image.file.name))
+                continue
+            finally:
+                image.file.close()
+            image.save(update_fields=['mime_type', 'file_size'])
+            updated += 1
+
+        self.stdout.write("%d images updated" % updated)
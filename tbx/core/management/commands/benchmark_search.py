@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailsearch.backends import get_search_backend
+
+
+DEFAULT_QUERIES = ['wagtail', 'drupal', 'design', 'developer', 'digital marketing']
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the query latency of the configured search backends, "
+        "searching live pages as the site search does."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'queries', nargs='*',
+            help="Queries to run (default: %s)" % ', '.join(DEFAULT_QUERIES))
+        parser.add_argument(
+            '--backend', action='append', dest='backend_names',
+            help="Backend to benchmark; may be repeated (default: all configured)")
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help="Number of times each query is run on each backend")
+
+    def time_query(self, backend, query, repeat):
+        timings = []
+        for i in range(repeat):
+            start = time.time()
+            # Results are lazy, so fetch the first page like the search view
+            list(backend.search(query, Page.objects.live())[:10])
+            timings.append((time.time() - start) * 1000)
+        timings.sort()
+        return timings
+
+    def handle(self, **options):
+        backend_names = options['backend_names'] or list(settings.WAGTAILSEARCH_BACKENDS.keys())
+        queries = options['queries'] or DEFAULT_QUERIES
+        repeat = options['repeat']
+
+        self.stdout.write("%-12s %-20s %9s %9s %9s" % ('backend', 'query', 'median', 'p95', 'max'))
+        for backend_name in backend_names:
+            backend = get_search_backend(backend_name)
+
+            # Warm up connections before timing
+            list(backend.search(queries[0], Page.objects.live())[:10])
+
+            all_timings = []
+            for query in queries:
+                timings = self.time_query(backend, query, repeat)
+                all_timings.extend(timings)
+                self.stdout.write("%-12s %-20s %7.1fms %7.1fms %7.1fms" % (
+                    backend_name, query[:20], timings[len(timings) // 2],
+                    timings[int(len(timings) * 0.95)], timings[-1]))
+
+            all_timings.sort()
+            self.stdout.write("%-12s %-20s %7.1fms %7.1fms %7.1fms" % (
+                backend_name, '(all)', all_timings[len(all_timings) // 2],
+                all_timings[int(len(all_timings) * 0.95)], all_timings[-1]))
@@ -0,0 +1,78 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max
+from django.utils.six.moves import zip
+
+from wagtail.wagtailimages.models import get_image_model
+
+from tbx.core.models import PendingRendition
+from tbx.core.renditions import run_pregeneration
+
+
+class Command(BaseCommand):
+    help = (
+        "Create any missing renditions of the images waiting for them (new "
+        "images and those used by newly published pages) for the filter "
+        "specs our templates use, in parallel. With --all, every image in "
+        "the library is queued first. Images are removed from the queue as "
+        "they are done, so an interrupted run can simply be run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', default=False,
+            help="Queue every image in the library")
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes")
+        parser.add_argument(
+            '--chunk-size', type=int, default=20,
+            help="Number of images handed to a worker at a time")
+
+    def handle(self, **options):
+        if options['all']:
+            PendingRendition.add(
+                get_image_model().objects.values_list('pk', flat=True))
+
+        # Images queued while this runs are left for the next run, as their
+        # files may have changed since they were processed here
+        last_pending_id = PendingRendition.objects.aggregate(Max('pk'))['pk__max']
+        if last_pending_id is None:
+            self.stdout.write("No images waiting for renditions")
+            return
+        pending = PendingRendition.objects.filter(pk__lte=last_pending_id)
+
+        image_ids = sorted(set(pending.values_list('image_id', flat=True)))
+        chunk_size = options['chunk_size']
+        chunks = [
+            image_ids[i:i + chunk_size]
+            for i in range(0, len(image_ids), chunk_size)
+        ]
+
+        # Workers are forked, so they mustn't inherit open connections
+        connections.close_all()
+        pool = multiprocessing.Pool(options['processes'])
+
+        created = 0
+        done = 0
+        try:
+            # imap() yields each chunk's result as soon as it and the chunks
+            # before it have completed, so finished images leave the queue
+            # as the run goes
+            results = pool.imap(run_pregeneration, chunks)
+            for chunk, chunk_created in zip(chunks, results):
+                if chunk_created is None:
+                    # Logged by the worker; leave the images queued
+                    continue
+                pending.filter(image_id__in=chunk).delete()
+                created += chunk_created
+                done += len(chunk)
+                if options['verbosity'] > 1:
+                    self.stdout.write("%d/%d images, %d renditions created" % (
+                        done, len(image_ids), created))
+        finally:
+            pool.terminate()
+
+        self.stdout.write("%d renditions created for %d images" % (created, done))
@@ -0,0 +1,137 @@
+import json
+import multiprocessing
+import os
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from wagtail.wagtailcore.models import Site
+
+from tbx.core.dependencies import get_dependents, model_dependency
+from tbx.core.models import PageChange
+from tbx.core.prerender import (MANIFEST_FILENAME, get_feed_paths,
+                                get_page_paths, remove_stale_paths,
+                                render_paths, write_file)
+
+
+class Command(BaseCommand):
+    help = (
+        "Render every live, public page of the default site and the blog "
+        "feeds to PRERENDER_ROOT, in parallel. With --incremental, only "
+        "render pages changed since the last run and the pages that list "
+        "or link to them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes")
+        parser.add_argument(
+            '--chunk-size', type=int, default=20,
+            help="Number of pages handed to a worker at a time")
+        parser.add_argument(
+            '--incremental', action='store_true', default=False,
+            help="Only render pages changed since the last run")
+
+    def read_manifest(self, root):
+        try:
+            with open(os.path.join(root, MANIFEST_FILENAME)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def get_changed_paths(self, site, paths, manifest):
+        since = parse_datetime(manifest['rendered_at'])
+        previous_paths = manifest['paths']
+
+        # Pages published, unpublished, moved or deleted since
+        changed = dict(
+            PageChange.objects.filter(
+                created_at__gte=since
+            ).values_list('page_id', 'content_type')
+        )
+        dependencies = set()
+        for pk, content_type_id in changed.items():
+            dependencies.add('page:%d' % pk)
+            dependencies.add(model_dependency(
+                ContentType.objects.get_for_id(content_type_id).model_class()
+            ))
+
+        # Pages that are no longer at their previous path
+        for path, pk in previous_paths.items():
+            if path not in paths:
+                dependencies.add('page:%d' % pk)
+
+        # New and changed pages, and those that failed to render last time
+        changed_paths = set(manifest['failed']) & set(paths)
+        changed_paths.update(
+            path for path, pk in paths.items()
+            if path not in previous_paths or pk in changed
+        )
+        # Pages that listed, linked to or otherwise used them
+        for url in get_dependents(dependencies):
+            if url.startswith(site.root_url + '/'):
+                path = url[len(site.root_url):]
+                if path in paths:
+                    changed_paths.add(path)
+        return changed_paths
+
+    def handle(self, **options):
+        root = getattr(settings, 'PRERENDER_ROOT', None)
+        if not root:
+            raise CommandError("PRERENDER_ROOT is not set")
+
+        site = Site.objects.get(is_default_site=True)
+        started_at = timezone.now()
+        paths = get_page_paths(site)
+
+        manifest = self.read_manifest(root) if options['incremental'] else None
+        if manifest is not None:
+            render = self.get_changed_paths(site, paths, manifest)
+        else:
+            render = set(paths)
+        render = sorted(render) + get_feed_paths()
+
+        # Files of pages that are no longer live or have moved are found on
+        # disk, so they are removed even if a previous run was interrupted
+        remove_stale_paths(root, set(paths) | set(get_feed_paths()))
+
+        chunk_size = options['chunk_size']
+        chunks = [
+            (root, site.hostname, render[i:i + chunk_size])
+            for i in range(0, len(render), chunk_size)
+        ]
+
+        # Workers are forked, so they mustn't inherit open connections
+        connections.close_all()
+        pool = multiprocessing.Pool(options['processes'])
+
+        rendered = set()
+        skipped = set()
+        try:
+            for chunk_rendered, chunk_skipped in pool.imap_unordered(render_paths, chunks):
+                rendered.update(chunk_rendered)
+                skipped.update(chunk_skipped)
+                if options['verbosity'] > 1:
+                    self.stdout.write("%d/%d pages rendered" % (len(rendered), len(render)))
+        finally:
+            pool.terminate()
+        failed = set(render) - rendered - skipped
+
+        # Changes made after the run started are picked up by the next one
+        write_file(os.path.join(root, MANIFEST_FILENAME), json.dumps({
+            'rendered_at': started_at.isoformat(),
+            'hostname': site.hostname,
+            'paths': paths,
+            'failed': sorted(failed),
+        }).encode('utf-8'))
+        PageChange.objects.filter(created_at__lt=started_at).delete()
+
+        self.stdout.write("%d of %d pages rendered, %d left to Django" % (
+            len(rendered), len(render), len(skipped)))
+        if failed:
+            self.stderr.write("%d pages failed to render, see the tbx.prerender log" % len(failed))
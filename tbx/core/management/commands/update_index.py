@@ -0,0 +1,122 @@
+import socket
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from wagtail.wagtailsearch.backends import get_search_backend
+from wagtail.wagtailsearch.index import class_is_indexed
+from wagtail.wagtailsearch.management.commands import update_index
+
+from tbx.core.models import IndexChange, IndexCheckpoint
+from tbx.core.search import LocalSearchBackend
+
+
+# Checkpoints not updated for this long are deleted, so that a host that no
+# longer runs update_index doesn't keep changes from being pruned. Its next
+# run is a full rebuild.
+CHECKPOINT_MAX_AGE = timedelta(days=7)
+
+# Changes are only applied once they are this old. Ids are allocated when a
+# change is inserted, so a transaction committing after a later one leaves
+# a lower id behind the newest; holding the newest changes back until the
+# next run keeps the checkpoint from passing it.
+CHANGE_SETTLE_TIME = timedelta(minutes=1)
+
+
+class Command(update_index.Command):
+    """
+    Wagtail's update_index, plus an --incremental mode that only reindexes
+    the objects saved or deleted since the command last ran (see
+    IndexChange), falling back to a full rebuild the first time.
+    """
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--incremental', action='store_true', default=False,
+            help="Only reindex objects changed since the last run")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of objects sent to the backend at a time")
+
+    def get_checkpoint(self, backend_name):
+        # Local backends have an index on each host, so their checkpoints
+        # are kept per host. Other backends are shared by every host.
+        name = backend_name
+        if isinstance(get_search_backend(backend_name), LocalSearchBackend):
+            name = '%s:%s' % (socket.gethostname(), backend_name)
+        checkpoint, created = IndexCheckpoint.objects.get_or_create(name=name)
+        return checkpoint
+
+    def update_backend_incremental(self, backend_name, since, until, batch_size):
+        backend = get_search_backend(backend_name)
+
+        object_ids = defaultdict(set)
+        changes = IndexChange.objects.filter(pk__gt=since, pk__lte=until)
+        for content_type_id, object_id in changes.values_list('content_type', 'object_id'):
+            object_ids[content_type_id].add(object_id)
+
+        added = deleted = 0
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None or not class_is_indexed(model):
+                continue
+
+            ids = sorted(model._meta.pk.to_python(object_id) for object_id in ids)
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                objects = list(model.get_indexed_objects().filter(pk__in=batch))
+                if objects:
+                    backend.add_bulk(model, objects)
+                    added += len(objects)
+
+                # Anything no longer in the indexed objects has been deleted
+                for pk in set(batch) - set(obj.pk for obj in objects):
+                    backend.delete(model(pk=pk))
+                    deleted += 1
+
+        self.stdout.write("%s: %d objects reindexed, %d removed" % (backend_name, added, deleted))
+
+    def handle(self, **options):
+        if options['backend_name']:
+            backend_names = [options['backend_name']]
+        elif hasattr(settings, 'WAGTAILSEARCH_BACKENDS'):
+            backend_names = settings.WAGTAILSEARCH_BACKENDS.keys()
+        else:
+            backend_names = ['default']
+
+        for backend_name in backend_names:
+            checkpoint = self.get_checkpoint(backend_name)
+            # Changes recorded while this runs, or shortly before, are
+            # picked up next time
+            last_change_id = max(
+                IndexChange.objects.filter(
+                    created_at__lt=timezone.now() - CHANGE_SETTLE_TIME
+                ).aggregate(Max('pk'))['pk__max'] or 0,
+                checkpoint.last_change_id or 0,
+            )
+
+            if options['incremental'] and checkpoint.last_change_id is not None:
+                self.update_backend_incremental(
+                    backend_name, checkpoint.last_change_id, last_change_id,
+                    options['batch_size']
+                )
+            else:
+                self.update_backend(backend_name, schema_only=options['schema_only'])
+                if options['schema_only']:
+                    continue
+
+            checkpoint.last_change_id = last_change_id
+            checkpoint.save(update_fields=['last_change_id', 'updated_at'])
+
+        # Changes applied everywhere are no longer needed
+        IndexCheckpoint.objects.filter(
+            updated_at__lt=timezone.now() - CHECKPOINT_MAX_AGE
+        ).delete()
+        applied = IndexCheckpoint.objects.aggregate(Min('last_change_id'))['last_change_id__min']
+        if applied:
+            IndexChange.objects.filter(pk__lte=applied).delete()
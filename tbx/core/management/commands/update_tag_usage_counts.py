@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tbx.core.models import BlogPageTagList
+
+
+class Command(BaseCommand):
+    help = "Recount the live blog pages using each blog tag"
+
+    def handle(self, **options):
+        BlogPageTagList.update_usage_counts()
+        self.stdout.write("%d tags counted" % BlogPageTagList.objects.count())
@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+from wagtail.wagtailcore.models import Site
+
+from tbx.core.cache import bump_generation, make_key
+from tbx.core.dependencies import record_model
+
+
+def get_menu_pages(menu):
+    """
+    Return a dict of {page id: path} for every page the menu links to.
+    """
+    pages = {}
+    for item in menu.menu:
+        if item.block_type != 'items':
+            continue
+        pages_in_item = [item.value['page']] + [
+            subitem.value for subitem in item.value['subitems']
+        ]
+        for page in pages_in_item:
+            if page is not None:
+                pages[page.pk] = page.path
+    return pages
+
+
+def get_menu_pages_key(site_id):
+    return make_key('main-menu', site_id, 'pages')
+
+
+def render_main_menu(site):
+    """
+    Render the main menu for a site, caching the HTML per site and
+    language until the menu or a page it links to changes. The pages each
+    site's menu links to are cached under their own key, so concurrent
+    renders never overwrite each other's.
+    """
+    from tbx.core.models import MainMenu
+
+    record_model(MainMenu)
+    key = make_key('main-menu', site.pk, translation.get_language())
+    html = cache.get(key)
+    if html is None:
+        menu = MainMenu.for_site(site)
+        html = render_to_string('torchbox/tags/main_menu.html', {
+            'menu': menu,
+        })
+        cache.set(get_menu_pages_key(site.pk), get_menu_pages(menu), None)
+        cache.set(key, html, None)
+    return mark_safe(html)
+
+
+def invalidate_main_menu():
+    bump_generation('main-menu')
+
+
+def page_affects_main_menu(page):
+    """
+    Check whether a change to 'page' changes the rendered menu, i.e. the
+    menu links to it or to one of its descendants (whose URL changes when
+    it is moved or its slug changes). Returns None if that isn't known,
+    as the pages a site's menu links to aren't in the cache.
+    """
+    keys = [get_menu_pages_key(site_id) for site_id in Site.objects.values_list('pk', flat=True)]
+    cached = cache.get_many(keys)
+    if len(cached) < len(keys):
+        return None
+    for pages in cached.values():
+        if page.pk in pages:
+            return True
+        if any(path.startswith(page.path) for path in pages.values()):
+            return True
+    return False
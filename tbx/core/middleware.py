@@ -0,0 +1,210 @@
+import random
+import time
+
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+from django.utils.encoding import force_bytes
+
+from tbx.core.dependencies import (save_dependencies, start_recording,
+                                   stop_recording)
+from tbx.core.profiling import (format_server_timing, format_stats, logger,
+                                start_profiling, stop_profiling)
+
+
+# Page cache
+#
+# Caches the rendered responses of Wagtail pages for anonymous visitors.
+# Entries are stored under a stable key together with the time they expire,
+# so that once they expire, or are expired early because something they
+# depend on was published (see expire_page_cache), they can still be served
+# while stale: the first request to find a stale entry takes a lock and
+# renders the page again, and every other request is served the old copy
+# until it is replaced.
+
+PAGE_CACHE_HEADER = 'X-Page-Cache'
+
+
+def get_page_cache_key(request):
+    # Requests with a query string aren't cached, so the path is enough
+    path = request.path
+    if request.is_ajax():
+        path += '#ajax'
+    return 'tbx:page-cache:%s:%s:%s' % (
+        request.site.pk,
+        translation.get_language(),
+        md5(force_bytes(path)).hexdigest(),
+    )
+
+
+def is_anonymous_request(request):
+    # Checking request.user would load the session, marking it accessed
+    # and so every response uncacheable. Visitors without a session cookie
+    # can't be logged in.
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def is_visitor_specific_response(request, response):
+    """
+    Return whether a response is specific to the visitor it was rendered
+    for, because it sets cookies, renders a CSRF token or reads the
+    session, so it mustn't be served to anyone else.
+    """
+    if response.cookies or request.META.get('CSRF_COOKIE_USED'):
+        return True
+    session = getattr(request, 'session', None)
+    return session is not None and session.accessed
+
+
+def expire_page_cache(keys):
+    """
+    Mark the given page cache entries stale, so they are only served while
+    a fresh copy is being rendered.
+    """
+    entries = cache.get_many(keys)
+    for entry in entries.values():
+        entry['expires'] = 0
+    cache.set_many(entries, settings.PAGE_CACHE_STALE_TIMEOUT)
+
+
+class PageCacheMiddleware(object):
+    """
+    Serve anonymous GET and HEAD requests for Wagtail pages from the cache.
+
+    Must come after SiteMiddleware. Only requests without a session cookie
+    or a query string are served from the cache, and responses are only stored if they don't
+    set cookies or use the session or CSRF token, so nothing specific to
+    one visitor is ever cached.
+    """
+    def is_cacheable_request(self, request):
+        return (
+            settings.PAGE_CACHE_TIMEOUT and
+            request.method in ('GET', 'HEAD') and
+            # Every distinct query string (tracking parameters, cache
+            # busters) would otherwise get its own entry
+            not request.META.get('QUERY_STRING') and
+            getattr(request, 'site', None) is not None and
+            is_anonymous_request(request)
+        )
+
+    def is_cacheable_response(self, request, response):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None or resolver_match.url_name != 'wagtail_serve':
+            return False
+        if request.method != 'GET' or response.status_code != 200:
+            return False
+        if response.streaming or is_visitor_specific_response(request, response):
+            return False
+
+        # The cache key covers ajax requests, but nothing else
+        if response.get('Vary', 'X-Requested-With') != 'X-Requested-With':
+            return False
+        cache_control = response.get('Cache-Control', '')
+        return 'private' not in cache_control and 'no-cache' not in cache_control
+
+    def get_cached_response(self, request, entry, status):
+        response = entry['response']
+        response[PAGE_CACHE_HEADER] = status
+        if request.method == 'HEAD':
+            response.content = b''
+        return response
+
+    def process_request(self, request):
+        if not self.is_cacheable_request(request):
+            return
+
+        key = get_page_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            if entry['expires'] > time.time():
+                return self.get_cached_response(request, entry, 'HIT')
+
+            # Stale: unless this request gets to render the page again,
+            # serve the old copy
+            if not cache.add(key + ':lock', True, settings.PAGE_CACHE_LOCK_TIMEOUT):
+                return self.get_cached_response(request, entry, 'STALE')
+            request._page_cache_locked = True
+
+        request._page_cache_key = key
+
+    def process_response(self, request, response):
+        key = getattr(request, '_page_cache_key', None)
+        if key is None:
+            return response
+
+        if self.is_cacheable_response(request, response):
+            cache.set(key, {
+                'response': response,
+                'expires': time.time() + settings.PAGE_CACHE_TIMEOUT,
+            }, settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_STALE_TIMEOUT)
+            response[PAGE_CACHE_HEADER] = 'MISS'
+
+        if getattr(request, '_page_cache_locked', False):
+            cache.delete(key + ':lock')
+        return response
+
+
+class DependencyMiddleware(object):
+    """
+    Record the dependencies of Wagtail pages rendered for anonymous
+    visitors (see tbx.core.dependencies), so they can be purged when
+    something they depend on is published.
+
+    Must come after PageCacheMiddleware, so that nothing is recorded for
+    responses served from the page cache.
+    """
+    def process_request(self, request):
+        if request.method == 'GET' and is_anonymous_request(request):
+            start_recording()
+
+    def process_response(self, request, response):
+        dependencies = stop_recording()
+        resolver_match = getattr(request, 'resolver_match', None)
+        if (
+            dependencies is not None and response.status_code == 200 and
+            resolver_match is not None and resolver_match.url_name == 'wagtail_serve'
+        ):
+            save_dependencies(
+                request.site.root_url + request.get_full_path(),
+                get_page_cache_key(request),
+                dependencies,
+            )
+        return response
+
+
+class TagProfilingMiddleware(object):
+    """
+    Profile the template tags rendered by a random sample of requests,
+    TAG_PROFILING_SAMPLE_RATE of them, and log the results to the
+    'tbx.profiling' logger (see tbx.core.profiling).
+
+    Staff users, or anyone when DEBUG is on, can also profile a request by
+    sending an X-Tag-Profile header, and get the results back in a
+    Server-Timing header.
+
+    Must come after AuthenticationMiddleware, and before
+    PageCacheMiddleware so that the header is never cached.
+    """
+    def wants_header(self, request):
+        return 'HTTP_X_TAG_PROFILE' in request.META and (
+            settings.DEBUG or request.user.is_staff
+        )
+
+    def process_request(self, request):
+        # In case an earlier request on this thread never got as far as
+        # process_response
+        stop_profiling()
+
+        request.tag_profiling_header = self.wants_header(request)
+        if request.tag_profiling_header or random.random() < settings.TAG_PROFILING_SAMPLE_RATE:
+            start_profiling()
+
+    def process_response(self, request, response):
+        stats = stop_profiling()
+        if stats:
+            logger.info("Template tags for %s: %s", request.path, format_stats(stats))
+            if getattr(request, 'tag_profiling_header', False):
+                response['Server-Timing'] = format_server_timing(stats)
+        return response
@@ -1,12 +1,24 @@
 from __future__ import unicode_literals
 
+import imghdr
+import random
+
+from hashlib import md5
+
 from django import forms
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+from django.utils.encoding import force_bytes, force_text
 from django.utils.functional import cached_property
+from django.utils.six import string_types
 from django.utils.translation import ugettext_lazy as _
 
 from modelcluster.fields import ParentalKey
@@ -19,8 +31,9 @@ from wagtail.wagtailcore.blocks import (CharBlock, FieldBlock, ListBlock,
                                         PageChooserBlock, RawHTMLBlock,
                                         RichTextBlock, StreamBlock,
                                         StructBlock)
-from wagtail.wagtailcore.fields import RichTextField, StreamField
-from wagtail.wagtailcore.models import Orderable, Page
+from wagtail.wagtailcore.fields import RichTextField
+from wagtail.wagtailcore.models import BasePageManager, Orderable, Page
+from wagtail.wagtailcore.query import PageQuerySet
 from wagtail.wagtaildocs.edit_handlers import DocumentChooserPanel
 from wagtail.wagtailembeds.blocks import EmbedBlock
 from wagtail.wagtailimages.blocks import ImageChooserBlock
@@ -28,12 +41,72 @@ from wagtail.wagtailimages.edit_handlers import ImageChooserPanel
 from wagtail.wagtailimages.models import (AbstractImage, AbstractRendition,
                                           Image)
 from wagtail.wagtailsearch import index
+
+from tbx.core.ancestors import get_ancestor_entries
+from tbx.core.blocks import BulkStreamField
+from tbx.core.cache import cached_result, make_key
+from tbx.core.dependencies import record, record_model, record_page
+from tbx.core.pagination import keyset_filter, keyset_paginate, parse_cursor
+from tbx.core.prefetch import PrefetchPlanMixin
+from tbx.core.renditions import prefetch_renditions
+from tbx.core.utils import play_path_q
 # from django.core.mail import EmailMessage
 # from wagtail.wagtailadmin.utils import send_mail
 # from wagtail.wagtailforms.models import AbstractEmailForm, AbstractFormField
 # from wagtail.wagtailsnippets.models import register_snippet
 
 
+# Page managers
+
+class TorchboxPageQuerySet(PageQuerySet):
+    def not_in_play(self):
+        """
+        Exclude pages in the Play section using path prefix predicates, so
+        the queryset stays lazy and can be sliced and counted in SQL.
+        """
+        q = play_path_q()
+        if not q:
+            return self
+        return self.exclude(q)
+
+    def sample(self, count, pool_name):
+        """
+        Return a list of up to 'count' pages picked at random from this
+        queryset, without ordering the table randomly in the database.
+
+        The ids to pick from are cached in the 'pool_name' generation, which
+        must be bumped whenever the pages matching this queryset may change.
+        The pool is also keyed by the queryset's SQL, so querysets sharing a
+        pool name don't share ids, and filters built from other data (such
+        as not_in_play()) get a new pool when that data changes. The picked
+        pages are fetched with this queryset, so stale ids in the pool are
+        simply dropped.
+        """
+        query_hash = md5(force_bytes(str(self.query))).hexdigest()
+        key = make_key(pool_name, query_hash, 'ids')
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.values_list('pk', flat=True))
+            cache.set(key, ids, None)
+
+        return self.in_order(random.sample(ids, min(count, len(ids))))
+
+    def in_order(self, ids):
+        """
+        Return a list of the pages in this queryset with the given ids, in
+        the order of 'ids', such as ids cached by cached_result().
+        """
+        pages = self.in_bulk(ids)
+        return [pages[pk] for pk in ids if pk in pages]
+
+
+class BaseTorchboxPageManager(BasePageManager):
+    def get_queryset(self):
+        return self._queryset_class(self.model).order_by('path')
+
+TorchboxPageManager = BaseTorchboxPageManager.from_queryset(TorchboxPageQuerySet)
+
+
 # Streamfield blocks and config
 
 class ImageFormatChoiceBlock(FieldBlock):
@@ -114,6 +187,23 @@ class StoryBlock(StreamBlock):
     # testimonial = PullQuoteImageBlock(label="Testimonial", icon="group")
     # stats = StatsBlock()
 
+    def get_rendition_specs(self, value):
+        """
+        Yield the (image, filter spec) pairs that includes/streamfield.html
+        renders for a StoryBlock value.
+        """
+        for child in value:
+            if child.block_type == 'aligned_image':
+                alignment = child.value['alignment']
+                if alignment in ('left', 'right'):
+                    yield child.value['image'], 'width-400'
+                elif alignment == 'half':
+                    yield child.value['image'], 'width-800'
+                else:
+                    yield child.value['image'], 'width-1280'
+            elif child.block_type in ('wide_image', 'bustout'):
+                yield child.value['image'], 'width-1280'
+
 
 # A couple of abstract classes that contain commonly used fields
 class ContentBlock(models.Model):
@@ -149,6 +239,7 @@ class LinkFields(models.Model):
     @property
     def link(self):
         if self.link_page:
+            record_page(self.link_page)
             return self.link_page.url
         elif self.link_document:
             return self.link_document.url
@@ -256,15 +347,56 @@ class Advert(models.Model):
 # Custom image
 class TorchboxImage(AbstractImage):
     credit = models.CharField(max_length=255, blank=True)
+    mime_type = models.CharField(max_length=100, blank=True, editable=False)
 
     admin_form_fields = Image.admin_form_fields + (
         'credit',
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(TorchboxImage, cls).from_db(db, field_names, values)
+        instance._loaded_file_name = dict(zip(field_names, values)).get('file')
+        return instance
+
+    def update_file_metadata(self):
+        """
+        Record the MIME type and size in bytes of the image file, so that
+        feeds and listings don't have to read the file from storage. Files
+        imghdr doesn't recognise are recorded as application/octet-stream,
+        so they aren't read again on every save.
+        """
+        image_format = imghdr.what(self.file)
+        self.mime_type = (
+            'image/{}'.format(image_format) if image_format
+            else 'application/octet-stream'
+        )
+        self.file_size = self.file.size
+
+    def save(self, *args, **kwargs):
+        file_changed = self.file.name != getattr(self, '_loaded_file_name', None)
+        if self.file and (file_changed or not self.mime_type or self.file_size is None):
+            try:
+                self.update_file_metadata()
+            except (IOError, OSError):
+                # File missing from storage; leave the metadata to the
+                # backfill_image_metadata command
+                pass
+        super(TorchboxImage, self).save(*args, **kwargs)
+        self._loaded_file_name = self.file.name
+
     @property
     def credit_text(self):
         return self.credit
 
+    def get_rendition(self, filter):
+        # Use renditions loaded by tbx.core.renditions.prefetch_renditions
+        spec = filter if isinstance(filter, string_types) else filter.spec
+        try:
+            return self.prefetched_renditions[spec]
+        except (AttributeError, KeyError):
+            return super(TorchboxImage, self).get_rendition(filter)
+
 
 # Receive the pre_delete signal and delete the file associated with the model instance.
 @receiver(pre_delete, sender=TorchboxImage)
@@ -289,6 +421,21 @@ def rendition_delete(sender, instance, **kwargs):
     instance.file.delete(False)
 
 
+class PendingRendition(models.Model):
+    """
+    An image whose renditions are waiting to be created by the
+    pregenerate_renditions command. Rows are deleted as the images are done,
+    so an interrupted run picks up where it stopped.
+    """
+    image = models.ForeignKey('TorchboxImage', related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def add(cls, image_ids):
+        image_ids = set(image_id for image_id in image_ids if image_id)
+        cls.objects.bulk_create([cls(image_id=image_id) for image_id in image_ids])
+
+
 # Home Page
 
 class HomePageHero(Orderable, RelatedLink):
@@ -340,7 +487,7 @@ class HomePageClient(Orderable, RelatedLink):
     ]
 
 
-class HomePage(Page):
+class HomePage(PrefetchPlanMixin, Page):
     hero_intro = models.TextField(blank=True, verbose_name=_('hero intro'))
     hero_video_id = models.IntegerField(blank=True, null=True, help_text=_("Optional. The numeric ID of a Vimeo video to replace the background image."))
     hero_video_poster_image = models.ForeignKey(
@@ -356,6 +503,11 @@ class HomePage(Page):
     blog_title = models.TextField(blank=True, verbose_name=_('blog title'))
     clients_title = models.TextField(blank=True, verbose_name=_('clients title'))
 
+    prefetch_related_plan = [
+        ('hero', ['background', 'logo', 'link_page', 'link_document']),
+        ('clients', ['image', 'link_page', 'link_document']),
+    ]
+
     class Meta:
         verbose_name = _("Homepage")
 
@@ -413,7 +565,7 @@ class StandardPageClient(Orderable, RelatedLink):
     ]
 
 
-class StandardPage(Page):
+class StandardPage(PrefetchPlanMixin, Page):
     main_image = models.ForeignKey(
         'torchbox.TorchboxImage',
         null=True,
@@ -424,7 +576,7 @@ class StandardPage(Page):
     )
     heading = RichTextField(blank=True, verbose_name=_('heading'))
     quote = models.CharField(max_length=255, blank=True, verbose_name=_('quote'))
-    streamfield = StreamField(StoryBlock(), verbose_name=_('stream field'))
+    streamfield = BulkStreamField(StoryBlock(), verbose_name=_('stream field'))
     email = models.EmailField(blank=True, verbose_name=_('email'))
 
     feed_image = models.ForeignKey(
@@ -457,10 +609,51 @@ class StandardPage(Page):
         ImageChooserPanel('feed_image'),
     ]
 
+    select_related_plan = ['main_image']
+    prefetch_related_plan = [
+        ('content_block', []),
+    ]
+
     class Meta:
         verbose_name = _("StandardPage")
 
 
+# Event page
+
+class EventPage(Page):
+    date_from = models.DateField(verbose_name=_('start date'))
+    date_to = models.DateField(
+        null=True, blank=True, verbose_name=_('end date'),
+        help_text=_("Leave blank for a one day event")
+    )
+    time_from = models.TimeField(null=True, blank=True, verbose_name=_('start time'))
+    time_to = models.TimeField(null=True, blank=True, verbose_name=_('end time'))
+    location = models.CharField(max_length=255, blank=True, verbose_name=_('location'))
+    body = RichTextField(blank=True, verbose_name=_('body'))
+
+    search_fields = Page.search_fields + [
+        index.SearchField('location'),
+        index.SearchField('body'),
+    ]
+
+    content_panels = [
+        FieldPanel('title', classname="full title"),
+        FieldPanel('date_from'),
+        FieldPanel('date_to'),
+        FieldPanel('time_from'),
+        FieldPanel('time_to'),
+        FieldPanel('location'),
+        FieldPanel('body', classname="full"),
+    ]
+
+    promote_panels = [
+        MultiFieldPanel(Page.promote_panels, _("Common page configuration")),
+    ]
+
+    class Meta:
+        verbose_name = _("Event Page")
+
+
 # About page
 class AboutPageRelatedLinkButton(Orderable, RelatedLink):
     page = ParentalKey('torchbox.AboutPage', related_name='related_link_buttons',
@@ -504,7 +697,7 @@ class AboutPageContentBlock(Orderable):
     ]
 
 
-class AboutPage(Page):
+class AboutPage(PrefetchPlanMixin, Page):
     main_image = models.ForeignKey(
         'torchbox.TorchboxImage',
         null=True,
@@ -529,6 +722,13 @@ class AboutPage(Page):
         FieldPanel('involvement_title'),
     ]
 
+    select_related_plan = ['main_image']
+    prefetch_related_plan = [
+        ('related_link_buttons', ['link_page', 'link_document']),
+        ('content_blocks', ['image']),
+        ('offices', []),
+    ]
+
     class Meta:
         verbose_name = _("AboutPage")
 
@@ -550,7 +750,7 @@ class ServicesPageService(Orderable):
         verbose_name = _("Service Item")
 
 
-class ServicesPage(Page):
+class ServicesPage(PrefetchPlanMixin, Page):
     main_image = models.ForeignKey(
         'torchbox.TorchboxImage',
         null=True,
@@ -574,96 +774,136 @@ class ServicesPage(Page):
         InlinePanel('services', label='Services'),
     ]
 
+    select_related_plan = ['main_image']
+    prefetch_related_plan = [
+        ('services', []),
+    ]
+
     class Meta:
         verbose_name = _("Service Page")
 
 
 # Blog index page
-#
-# class BlogIndexPageRelatedLink(Orderable, RelatedLink):
-#     page = ParentalKey('torchbox.BlogIndexPage', related_name='related_links',
-#                        verbose_name=_('related links'))
-#
-#
-# class BlogIndexPage(Page):
-#     intro = models.TextField(blank=True, verbose_name=_('intro'))
-#
-#     search_fields = Page.search_fields + [
-#         index.SearchField('intro'),
-#     ]
-#
-#     show_in_play_menu = models.BooleanField(default=False)
-#
-#     def get_popular_tags(self):
-#         # Get a ValuesQuerySet of tags ordered by most popular (exclude 'planet-drupal' as this is effectively
-#         # the same as Drupal and only needed for the rss feed)
-#         popular_tags = BlogPageTagSelect.objects.all().exclude(tag__name='planet-drupal').values('tag').annotate(item_count=models.Count('tag')).order_by('-item_count')
-#
-#         # Return first 10 popular tags as tag objects
-#         # Getting them individually to preserve the order
-#         return [BlogPageTagList.objects.get(id=tag['tag']) for tag in popular_tags[:10]]
-#
-#     @property
-#     def blog_posts(self):
-#         # Get list of blog pages that are descendants of this page
-#         # and are not marketing_only
-#         blog_posts = BlogPage.objects.filter(
-#             live=True,
-#             path__startswith=self.path
-#         )#.exclude(marketing_only=True)
-#
-#         # Order by most recent date first
-#         blog_posts = blog_posts.order_by('-date', 'pk')
-#
-#         return blog_posts
-#
-#     def serve(self, request):
-#         # Get blog_posts
-#         blog_posts = self.blog_posts
-#
-#         # Filter by tag
-#         tag = request.GET.get('tag')
-#         if tag:
-#             blog_posts = blog_posts.filter(tags__tag__slug=tag)
-#
-#         # Pagination
-#         per_page = 12
-#         page = request.GET.get('page')
-#         paginator = Paginator(blog_posts, per_page)  # Show 10 blog_posts per page
-#         try:
-#             blog_posts = paginator.page(page)
-#         except PageNotAnInteger:
-#             blog_posts = paginator.page(1)
-#         except EmptyPage:
-#             blog_posts = paginator.page(paginator.num_pages)
-#
-#         if request.is_ajax():
-#             return render(request, "torchbox/includes/blog_listing.html", {
-#                 'self': self,
-#                 'blog_posts': blog_posts,
-#                 'per_page': per_page,
-#             })
-#         else:
-#             return render(request, self.template, {
-#                 'self': self,
-#                 'blog_posts': blog_posts,
-#                 'per_page': per_page,
-#             })
-#
-#     content_panels = [
-#         FieldPanel('title', classname="full title"),
-#         FieldPanel('intro', classname="full"),
-#         InlinePanel('related_links', label="Related links"),
-#     ]
-#
-#     promote_panels = [
-#         MultiFieldPanel(Page.promote_panels, _("Common page configuration")),
-#         FieldPanel('show_in_play_menu'),
-#     ]
-#
-#     class Meta:
-#         verbose_name = _("Blog Index Page")
-#
+# BlogPage.blog_index, blog_index_page.html and the get_popular_tags tag all
+# rely on this page type, so it can't stay commented out.
+
+class BlogIndexPageRelatedLink(Orderable, RelatedLink):
+    page = ParentalKey('torchbox.BlogIndexPage', related_name='related_links',
+                       verbose_name=_('related links'))
+
+
+class BlogIndexPage(Page):
+    intro = models.TextField(blank=True, verbose_name=_('intro'))
+
+    search_fields = Page.search_fields + [
+        index.SearchField('intro'),
+    ]
+
+    show_in_play_menu = models.BooleanField(default=False)
+
+    def get_popular_tags(self):
+        # Tags ordered by the number of live posts using them (exclude 'planet-drupal' as this is effectively
+        # the same as Drupal and only needed for the rss feed)
+        return list(
+            BlogPageTagList.objects.filter(usage_count__gt=0)
+            .exclude(name='planet-drupal')
+            .order_by('-usage_count', 'name')[:10]
+        )
+
+    @property
+    def blog_posts(self):
+        # Get list of blog pages that are descendants of this page
+        # and are not marketing_only
+        blog_posts = BlogPage.objects.filter(
+            live=True,
+            path__startswith=self.path
+        )#.exclude(marketing_only=True)
+
+        # Order by most recent date first
+        blog_posts = blog_posts.order_by('-date', '-pk')
+
+        return blog_posts
+
+    def get_listing_tag(self, request):
+        """
+        Return the slug of the tag the listing is filtered by, or None.
+        Raises Http404 for tags that don't exist.
+        """
+        tag = request.GET.get('tag')
+        if not tag:
+            return None
+        if not BlogPageTagList.objects.filter(slug=tag).exists():
+            raise Http404("No such tag")
+        return tag
+
+    def get_listing_page(self, tag, after, before, per_page):
+        blog_posts = self.blog_posts
+
+        # Filter by tag
+        if tag:
+            blog_posts = blog_posts.filter(tags__tag__slug=tag)
+
+        return keyset_paginate(blog_posts, per_page, after=after, before=before)
+
+    def serve(self, request):
+        per_page = 12
+        record_model(BlogPage)
+
+        tag = self.get_listing_tag(request)
+        after = request.GET.get('after')
+        before = request.GET.get('before')
+
+        if request.is_ajax():
+            # The listing fragment loaded by ajax-load.js, cached per tag
+            # and position until a blog page is published or unpublished.
+            # The key is made from the decoded cursor, so invalid cursors
+            # share the first page's entry.
+            after_position = parse_cursor(after)
+            before_position = parse_cursor(before)
+            if after_position is not None:
+                position = ['after'] + list(after_position)
+            elif before_position is not None:
+                position = ['before'] + list(before_position)
+            else:
+                position = ['first']
+            parts = [tag or ''] + [force_text(part) for part in position]
+            key = make_key(
+                'blog-listing', self.pk, md5(force_bytes('|'.join(parts))).hexdigest()
+            )
+            content = cache.get(key)
+            if content is None:
+                content = render_to_string("torchbox/includes/blog_listing.html", {
+                    'self': self,
+                    'blog_posts': self.get_listing_page(tag, after, before, per_page),
+                    'per_page': per_page,
+                    'request': request,
+                })
+                cache.set(key, content, settings.BLOG_LISTING_CACHE_TIMEOUT)
+            response = HttpResponse(content)
+        else:
+            response = render(request, self.template, {
+                'self': self,
+                'blog_posts': self.get_listing_page(tag, after, before, per_page),
+                'per_page': per_page,
+            })
+
+        patch_vary_headers(response, ['X-Requested-With'])
+        return response
+
+    content_panels = [
+        FieldPanel('title', classname="full title"),
+        FieldPanel('intro', classname="full"),
+        InlinePanel('related_links', label="Related links"),
+    ]
+
+    promote_panels = [
+        MultiFieldPanel(Page.promote_panels, _("Common page configuration")),
+        FieldPanel('show_in_play_menu'),
+    ]
+
+    class Meta:
+        verbose_name = _("Blog Index Page")
+
 
 # Blog page
 class BlogPageRelatedLink(Orderable, RelatedLink):
@@ -673,10 +913,33 @@ class BlogPageRelatedLink(Orderable, RelatedLink):
 class BlogPageTagList(models.Model):
     name = models.CharField(max_length=255)
     slug = models.CharField(max_length=255)
+    # The number of live blog pages with this tag, maintained by
+    # update_usage_counts() as pages are published and unpublished
+    usage_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
 
     def __unicode__(self):
         return self.name
 
+    @classmethod
+    def update_usage_counts(cls, tag_ids=None):
+        """
+        Recount the live blog pages using the given tags, or every tag.
+        """
+        tags = cls.objects.all()
+        if tag_ids is not None:
+            tags = tags.filter(pk__in=tag_ids)
+
+        counts = dict(
+            BlogPageTagSelect.objects.filter(
+                tag__in=tags, page__live=True
+            ).values('tag').annotate(
+                count=models.Count('page', distinct=True)
+            ).values_list('tag', 'count')
+        )
+        for tag_id, usage_count in tags.values_list('pk', 'usage_count'):
+            if counts.get(tag_id, 0) != usage_count:
+                cls.objects.filter(pk=tag_id).update(usage_count=counts.get(tag_id, 0))
+
 # register_snippet(BlogPageTagList)
 
 
@@ -703,7 +966,7 @@ class BlogPageAuthor(Orderable):
     ]
 
 
-class BlogPage(Page):
+class BlogPage(PrefetchPlanMixin, Page):
     # intro = RichTextField("Intro (used for blog index and Planet Drupal listings)", blank=True)
     # body = RichTextField("body (deprecated. Use streamfield instead)", blank=True)
     # colour = models.CharField(
@@ -716,7 +979,7 @@ class BlogPage(Page):
     #     max_length=255,
     #     blank=True
     # )
-    streamfield = StreamField(StoryBlock(), verbose_name=_('body'))
+    streamfield = BulkStreamField(StoryBlock(), verbose_name=_('body'))
     # author_left = models.CharField(max_length=255, blank=True, help_text=_('author who has left Torchbox'))
     date = models.DateField(_("Post date"))
     feed_image = models.ForeignKey(
@@ -731,19 +994,82 @@ class BlogPage(Page):
 
     canonical_url = models.URLField(blank=True, max_length=255)
 
+    objects = TorchboxPageManager()
+
     search_fields = Page.search_fields + [
         # index.SearchField('body'),
     ]
 
+    select_related_plan = ['feed_image']
+    prefetch_related_plan = [
+        ('related_author', ['author__image']),
+        ('tags', ['tag']),
+    ]
+
     class Meta:
         verbose_name = _("Blog Page")
+        index_together = [
+            # Keyset ordering for listings and previous/next links
+            ('date', 'page_ptr'),
+        ]
+
+    def get_neighbour_ids(self):
+        """
+        Return the ids of the live, non-Play posts immediately older
+        ('next') and newer ('prev') than this one, ordered by (date, id).
+        Unsaved pages (being previewed) are compared on their date alone.
+        """
+        posts = BlogPage.objects.live().not_in_play()
+        if self.pk is None:
+            older = posts.filter(date__lt=self.date)
+            newer = posts.filter(date__gt=self.date)
+        else:
+            older = keyset_filter(posts, 'date', self.date, self.pk, '<')
+            newer = keyset_filter(posts, 'date', self.date, self.pk, '>')
+        return {
+            'next': older.order_by('-date', '-pk').values_list('pk', flat=True).first(),
+            'prev': newer.order_by('date', 'pk').values_list('pk', flat=True).first(),
+        }
+
+    def get_cached_neighbour_ids(self):
+        return cache.get(make_key('blog-neighbours', self.pk))
+
+    @cached_property
+    def blog_neighbours(self):
+        """
+        The posts from get_neighbour_ids(). The ids are cached until a blog
+        page is published or unpublished, which purges the posts whose
+        neighbours it changed (see tbx.core.signal_handlers).
+        """
+        if self.pk is None:
+            # Previewing a new page, which nothing can be purged for
+            ids = self.get_neighbour_ids()
+        else:
+            record('blog-neighbours:%d' % self.pk)
+            ids = self.get_cached_neighbour_ids()
+            if ids is None:
+                ids = self.get_neighbour_ids()
+                cache.set(make_key('blog-neighbours', self.pk), ids, None)
+
+        pages = BlogPage.objects.select_related('feed_image').in_bulk(
+            [pk for pk in ids.values() if pk is not None]
+        )
+        for page in pages.values():
+            record_page(page)
+        return {
+            direction: pages.get(pk)
+            for direction, pk in ids.items()
+        }
 
     @property
     def blog_index(self):
-        # Find blog index in ancestors
-        for ancestor in reversed(self.get_ancestors()):
-            if isinstance(ancestor.specific, BlogIndexPage):
-                return ancestor
+        # Find blog index in ancestors, using the cached ancestor chain so
+        # only the blog index itself is loaded
+        for entry in reversed(get_ancestor_entries(self)):
+            model = ContentType.objects.get_for_id(entry['content_type']).model_class()
+            if model is not None and issubclass(model, BlogIndexPage):
+                record('page:%d' % entry['id'])
+                return BlogIndexPage.objects.get(pk=entry['id'])
 
         # No ancestors are blog indexes,
         # just return first blog index in database
@@ -755,6 +1081,12 @@ class BlogPage(Page):
             if author.author:
                 return True
 
+    def get_context(self, request, *args, **kwargs):
+        # The authors' names and portraits are shown on the page
+        for author in self.related_author.all():
+            record_page(author.author)
+        return super(BlogPage, self).get_context(request, *args, **kwargs)
+
     content_panels = [
         FieldPanel('title', classname="full title"),
         InlinePanel('related_author', label=_("Author")),
@@ -771,6 +1103,13 @@ class BlogPage(Page):
     ]
 
 
+@cached_result('latest-blog-posts', models=[BlogPage], local_size=8)
+def get_latest_blog_post_ids(count):
+    return list(
+        BlogPage.objects.live().order_by('-date').values_list('pk', flat=True)[:count]
+    )
+
+
 # Jobs index page
 class ReasonToJoin(Orderable):
     page = ParentalKey('torchbox.JobIndexPage', related_name='reasons_to_join')
@@ -811,7 +1150,7 @@ class JobIndexPageJob(Orderable):
     class Meta:
         verbose_name = _('Job Item')
 
-class JobIndexPage(Page):
+class JobIndexPage(PrefetchPlanMixin, Page):
     intro = models.TextField(blank=True, verbose_name=_('intro'))
     listing_intro = models.TextField(
         blank=True,
@@ -832,7 +1171,8 @@ class JobIndexPage(Page):
             JobIndexPage, self
         ).get_context(request, *args, **kwargs)
         context['jobs'] = self.job.all()
-        context['blogs'] = BlogPage.objects.live().order_by('-date')[:4]
+        record_model(BlogPage)
+        context['blogs'] = BlogPage.objects.live().in_order(get_latest_blog_post_ids(4))
         return context
 
     content_panels = [
@@ -851,6 +1191,11 @@ class JobIndexPage(Page):
         MultiFieldPanel(Page.promote_panels, _("Common page configuration")),
     ]
 
+    prefetch_related_plan = [
+        ('job', []),
+        ('reasons_to_join', ['image']),
+    ]
+
     class Meta:
         verbose_name = _('Job Index Page')
 
@@ -860,7 +1205,7 @@ class PersonPageRelatedLink(Orderable, RelatedLink):
     page = ParentalKey('torchbox.PersonPage', related_name='related_links')
 
 
-class PersonPage(Page, ContactFields):
+class PersonPage(PrefetchPlanMixin, Page, ContactFields):
     first_name = models.CharField(max_length=255, verbose_name=_('first name'))
     last_name = models.CharField(max_length=255, verbose_name=_('last name'))
     role = models.CharField(max_length=255, blank=True, verbose_name=_('role'))
@@ -884,6 +1229,10 @@ class PersonPage(Page, ContactFields):
         verbose_name=_('feed image')
     )
 
+    objects = TorchboxPageManager()
+
+    select_related_plan = ['image']
+
     search_fields = Page.search_fields + [
         index.SearchField('first_name'),
         index.SearchField('last_name'),
@@ -923,12 +1272,41 @@ class PersonIndexPage(Page):
         verbose_name = _("Person Index Page")
 
     @cached_property
+    def people_by_seniority(self):
+        """
+        Return a tuple of (senior management, everyone else), in tree order,
+        with their images and portrait renditions loaded in bulk.
+
+        The ids of the live, public people are cached until a PersonPage is
+        published or unpublished or a view restriction changes, so the
+        costly public() check only runs on a cache miss.
+        """
+        record_model(PersonPage)
+        key = make_key('person-index', 'ids')
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(PersonPage.objects.live().public().values_list('pk', 'is_senior'))
+            cache.set(key, ids, None)
+
+        pages = PersonPage.objects.live().select_related('image').in_bulk(
+            [pk for pk, is_senior in ids]
+        )
+        senior_management = []
+        people = []
+        for pk, is_senior in ids:
+            if pk in pages:
+                (senior_management if is_senior else people).append(pages[pk])
+
+        prefetch_renditions((page.image, 'fill-400x400') for page in pages.values())
+        return senior_management, people
+
+    @property
     def people(self):
-        return PersonPage.objects.exclude(is_senior=True).live().public()
+        return self.people_by_seniority[1]
 
-    @cached_property
+    @property
     def senior_management(self):
-        return PersonPage.objects.exclude(is_senior=False).live().public()
+        return self.people_by_seniority[0]
 
     content_panels = Page.content_panels + [
         FieldPanel('intro', classname="full"),
@@ -994,7 +1372,7 @@ class MenuBlock(StreamBlock):
 
 @register_setting
 class MainMenu(BaseSetting):
-    menu = StreamField(MenuBlock(), blank=True, verbose_name=_('menu'))
+    menu = BulkStreamField(MenuBlock(), blank=True, verbose_name=_('menu'))
 
     panels = [
         StreamFieldPanel('menu'),
@@ -1002,3 +1380,50 @@ class MainMenu(BaseSetting):
 
     class Meta:
         verbose_name = _('Main Menu')
+
+
+# Search index change log
+
+class IndexChange(models.Model):
+    """
+    A record of an indexed object being saved or deleted, so that
+    update_index --incremental can reindex just the objects changed since
+    it last ran.
+    """
+    content_type = models.ForeignKey('contenttypes.ContentType', related_name='+')
+    object_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def record(cls, instance):
+        if isinstance(instance, Page):
+            # The specific page type, without loading the specific page
+            content_type_id = instance.content_type_id
+        else:
+            content_type_id = ContentType.objects.get_for_model(instance).pk
+        cls.objects.create(content_type_id=content_type_id, object_id=str(instance.pk))
+
+
+class PageChange(models.Model):
+    """
+    A record of a page being published, unpublished, moved or deleted, so
+    that prerender_site --incremental can render just the pages changed
+    since it last ran.
+    """
+    page_id = models.PositiveIntegerField()
+    content_type = models.ForeignKey('contenttypes.ContentType', related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @classmethod
+    def record(cls, page):
+        cls.objects.create(page_id=page.pk, content_type_id=page.content_type_id)
+
+
+class IndexCheckpoint(models.Model):
+    """
+    The last IndexChange applied to a search backend, or None if the index
+    has never been built. Local backends have a checkpoint per host.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    last_change_id = models.PositiveIntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
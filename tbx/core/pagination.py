@@ -0,0 +1,114 @@
+from __future__ import unicode_literals
+
+from django.core import signing
+from django.db import connection
+from django.utils.dateparse import parse_date
+
+
+# Keyset pagination
+#
+# Pages of results are fetched relative to the (date, id) of the last item
+# shown rather than with an OFFSET, so every page costs the same indexed
+# range scan however deep into the archive it is, and no COUNT(*) is
+# needed. Positions are passed around as signed, opaque cursor tokens.
+
+CURSOR_SALT = 'tbx.core.pagination'
+
+
+def make_cursor(date, pk):
+    return signing.dumps([date.isoformat(), pk], salt=CURSOR_SALT, compress=True)
+
+
+def parse_cursor(token):
+    """
+    Return the (date, pk) position in a cursor token, or None if the token
+    is missing or invalid.
+    """
+    if not token:
+        return None
+    try:
+        date, pk = signing.loads(token, salt=CURSOR_SALT)
+        date = parse_date(date)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if date is None or not isinstance(pk, int):
+        return None
+    return date, pk
+
+
+class KeysetPage(object):
+    """
+    One page of a keyset-paginated queryset, newest first. Iterating over it
+    gives the items; next_cursor and previous_cursor are the tokens of the
+    following (older) and preceding (newer) pages, or None.
+    """
+    def __init__(self, object_list, date_field, has_next, has_previous):
+        self.object_list = object_list
+        self.date_field = date_field
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor(self, obj):
+        return make_cursor(getattr(obj, self.date_field), obj.pk)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor(self.object_list[0])
+
+
+def keyset_filter(queryset, date_field, date, pk, operator):
+    """
+    Filter 'queryset' to the items whose (date, id) is less than ('<') or
+    greater than ('>') (date, pk). This is written as a row comparison, as
+    databases only use a (date, id) index for the equivalent OR of two
+    conditions if they rewrite it themselves.
+    """
+    if operator not in ('<', '>'):
+        raise ValueError("operator must be '<' or '>'")
+    opts = queryset.model._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    where = '(%s.%s, %s.%s) %s (%%s, %%s)' % (
+        table, qn(opts.get_field(date_field).column),
+        table, qn(opts.pk.column),
+        operator,
+    )
+    return queryset.extra(where=[where], params=[date, pk])
+
+
+def keyset_paginate(queryset, per_page, date_field='date', after=None, before=None):
+    """
+    Return the KeysetPage of 'queryset' following the 'after' cursor token,
+    preceding the 'before' token, or the first page if neither is valid.
+    """
+    after = parse_cursor(after)
+    before = parse_cursor(before) if after is None else None
+
+    if before is not None:
+        date, pk = before
+        items = list(keyset_filter(queryset, date_field, date, pk, '>').order_by(
+            date_field, 'pk')[:per_page + 1])
+        has_previous = len(items) > per_page
+        items = items[:per_page][::-1]
+        return KeysetPage(items, date_field, has_next=True, has_previous=has_previous)
+
+    if after is not None:
+        date, pk = after
+        queryset = keyset_filter(queryset, date_field, date, pk, '<')
+    items = list(queryset.order_by('-' + date_field, '-pk')[:per_page + 1])
+    has_next = len(items) > per_page
+    return KeysetPage(
+        items[:per_page], date_field, has_next=has_next, has_previous=after is not None
+    )
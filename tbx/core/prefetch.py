@@ -0,0 +1,51 @@
+from django.db.models import Prefetch
+from django.db.models.query import prefetch_related_objects
+
+
+# Prefetch plans
+#
+# Page types declare the relations their templates follow, so they are
+# loaded in bulk when the page is served rather than one query at a time
+# from the templates:
+#
+#     class HomePage(PrefetchPlanMixin, Page):
+#         select_related_plan = ['hero_video_poster_image']
+#         prefetch_related_plan = [
+#             ('hero', ['background', 'logo', 'link_page', 'link_document']),
+#         ]
+#
+# 'select_related_plan' lists foreign keys of the page itself.
+# 'prefetch_related_plan' lists child relations, each with the foreign keys
+# of its objects to join, so a child relation costs a single query however
+# many objects it has.
+
+
+class PrefetchPlanMixin(object):
+    select_related_plan = []
+    prefetch_related_plan = []
+
+    def apply_prefetch_plan(self):
+        lookups = list(self.select_related_plan)
+        in_memory = getattr(self, '_cluster_related_objects', {})
+
+        for relation, select_related in self.prefetch_related_plan:
+            if relation in in_memory:
+                # Previews hold the child objects in memory, so only their
+                # foreign keys need loading
+                if in_memory[relation] and select_related:
+                    prefetch_related_objects(in_memory[relation], list(select_related))
+                continue
+
+            model = self._meta.get_field(relation).related_model
+            lookups.append(Prefetch(
+                relation,
+                queryset=model._default_manager.select_related(*select_related),
+            ))
+
+        if lookups:
+            prefetch_related_objects([self], lookups)
+
+    def serve(self, request, *args, **kwargs):
+        # Previews are served through serve() as well
+        self.apply_prefetch_plan()
+        return super(PrefetchPlanMixin, self).serve(request, *args, **kwargs)
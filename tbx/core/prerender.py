@@ -0,0 +1,206 @@
+import errno
+import json
+import logging
+import os
+
+from posixpath import normpath
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+from whitenoise.base import MissingFileError, NotARegularFileError
+from whitenoise.django import DjangoWhiteNoise
+
+from wagtail.wagtailcore.models import Page
+
+
+logger = logging.getLogger('tbx.prerender')
+
+
+# Pre-rendering
+#
+# Live, public pages of the default site are rendered to
+# PRERENDER_ROOT/<path>/index.html, and feeds to <path>/index.xml, so the
+# output can be served by any web server configured with those index
+# files, or by PrerenderedWhiteNoise below.
+
+INDEX_FILENAMES = ['index.html', 'index.xml']
+
+MANIFEST_FILENAME = '.prerender-manifest.json'
+
+
+def get_feed_paths():
+    return [reverse('blog_feed'), reverse('planet_drupal_feed')]
+
+
+def get_page_paths(site):
+    """
+    Return a dict of {path: page id} for the live, public pages of 'site'.
+    """
+    paths = {}
+    pages = Page.objects.live().public().descendant_of(site.root_page, inclusive=True)
+    for page in pages.only('pk', 'url_path'):
+        url_parts = page.get_url_parts()
+        if url_parts is not None and url_parts[0] == site.pk:
+            paths[url_parts[2]] = page.pk
+    return paths
+
+
+def get_output_path(root, path, filename):
+    return os.path.join(root, path.strip('/'), filename)
+
+
+def write_file(output_path, content):
+    # Write to a temporary file and rename it into place, so that the web
+    # server never sees a partially written file
+    try:
+        os.makedirs(os.path.dirname(output_path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.rename(temp_path, output_path)
+
+
+def remove_path(root, path):
+    for filename in INDEX_FILENAMES:
+        try:
+            os.remove(get_output_path(root, path, filename))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def remove_stale_paths(root, paths):
+    """
+    Remove the rendered files below 'root' of every path not in 'paths'.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative_path = os.path.relpath(dirpath, root)
+        if relative_path == os.curdir:
+            path = '/'
+        else:
+            path = '/%s/' % relative_path.replace(os.sep, '/')
+        if path not in paths and any(name in INDEX_FILENAMES for name in filenames):
+            remove_path(root, path)
+
+
+def render_paths(args):
+    """
+    Pool worker entry point: render each of 'paths' on 'hostname' as an
+    anonymous visitor and write it below 'root'. Pages that can't be served
+    to every visitor are skipped, and any previous copy removed. Returns the
+    paths that were rendered and those that were skipped.
+    """
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    from tbx.core.middleware import is_visitor_specific_response
+
+    root, hostname, paths = args
+    rendered = []
+    skipped = []
+
+    # Don't serve pages from the page cache, which may hold a stale copy
+    with override_settings(PAGE_CACHE_TIMEOUT=0):
+        for path in paths:
+            # A new client for each page, so no cookies are sent back
+            client = Client(HTTP_HOST=hostname)
+            try:
+                response = client.get(path)
+            except Exception:
+                logger.exception("Error rendering %s", path)
+                continue
+
+            if response.status_code != 200:
+                logger.warning("Not rendering %s: status %d", path, response.status_code)
+                remove_path(root, path)
+                continue
+
+            # Pages with forms (CSRF tokens), anything else specific to the
+            # visitor, and pages that change on every request (such as a
+            # random sample) are left to Django
+            request = response.wsgi_request
+            if (
+                is_visitor_specific_response(request, response) or
+                getattr(request, 'varies_per_request', False)
+            ):
+                logger.info("Not rendering %s: varies per request", path)
+                remove_path(root, path)
+                skipped.append(path)
+                continue
+
+            if response['Content-Type'].split(';')[0].endswith('xml'):
+                filename = 'index.xml'
+            else:
+                filename = 'index.html'
+            write_file(get_output_path(root, path, filename), response.content)
+            rendered.append(path)
+    return rendered, skipped
+
+
+class PrerenderedWhiteNoise(DjangoWhiteNoise):
+    """
+    DjangoWhiteNoise that also serves pre-rendered pages from PRERENDER_ROOT
+    to anonymous visitors. Pre-rendered files are looked up on each request,
+    as they are replaced while the site is running.
+    """
+    def __init__(self, application, settings=settings):
+        super(PrerenderedWhiteNoise, self).__init__(application, settings=settings)
+        self.prerender_root = settings.PRERENDER_ROOT
+        self.session_cookie = settings.SESSION_COOKIE_NAME + '='
+        self.manifest_mtime = None
+        self.hostname = None
+
+    def get_hostname(self):
+        """
+        Return the hostname the pre-rendered pages were rendered for, from
+        the manifest prerender_site writes, reading it again when it
+        changes.
+        """
+        manifest_path = os.path.join(self.prerender_root, MANIFEST_FILENAME)
+        try:
+            mtime = os.stat(manifest_path).st_mtime
+            if mtime != self.manifest_mtime:
+                with open(manifest_path) as f:
+                    self.hostname = json.load(f).get('hostname')
+                self.manifest_mtime = mtime
+        except (IOError, OSError, ValueError):
+            return None
+        return self.hostname
+
+    def find_prerendered_file(self, environ):
+        # Logged in users and requests with a query string always go to
+        # Django
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD') or environ.get('QUERY_STRING'):
+            return
+        if self.session_cookie in environ.get('HTTP_COOKIE', ''):
+            return
+
+        # Pages are only rendered for the default site
+        host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+        if not host or host != self.get_hostname():
+            return
+
+        url = environ['PATH_INFO']
+        if not url.endswith('/'):
+            return
+        if url != '/' and normpath(url) != url.rstrip('/'):
+            # Reject path traversal
+            return
+
+        for filename in INDEX_FILENAMES:
+            path = get_output_path(self.prerender_root, url, filename)
+            try:
+                return self.get_static_file(path, url)
+            except (MissingFileError, NotARegularFileError):
+                pass
+
+    def __call__(self, environ, start_response):
+        if self.prerender_root:
+            static_file = self.find_prerendered_file(environ)
+            if static_file is not None:
+                return self.serve(static_file, environ, start_response)
+        return super(PrerenderedWhiteNoise, self).__call__(environ, start_response)
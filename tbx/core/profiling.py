@@ -0,0 +1,115 @@
+import logging
+import threading
+
+from itertools import islice
+from timeit import default_timer
+
+from django.db import connection
+
+
+logger = logging.getLogger('tbx.profiling')
+
+
+# Template tag profiling
+#
+# For a sample of requests (see TagProfilingMiddleware), every call of an
+# instrumented template tag is timed, and the SQL queries it makes are
+# counted and timed, using the query log Django keeps when
+# force_debug_cursor is set. Times include any tags rendered by the tag
+# itself, such as those in an inclusion tag's template.
+#
+# Outside profiled requests, an instrumented tag only costs a thread-local
+# lookup per call.
+
+_local = threading.local()
+
+
+def start_profiling():
+    _local.stats = {}
+    _local.force_debug_cursor = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+
+
+def stop_profiling():
+    """
+    Stop profiling and return a dict of {tag name: [calls, queries, query
+    time, time]}, with times in seconds, or None if profiling wasn't
+    started.
+    """
+    stats = _local.__dict__.pop('stats', None)
+    if stats is not None:
+        connection.force_debug_cursor = _local.__dict__.pop('force_debug_cursor')
+    return stats
+
+
+def instrument_render(name, render):
+    def instrumented_render(context):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return render(context)
+
+        queries_before = len(connection.queries_log)
+        started = default_timer()
+        try:
+            return render(context)
+        finally:
+            elapsed = default_timer() - started
+            queries = list(islice(connection.queries_log, queries_before, None))
+
+            tag_stats = stats.setdefault(name, [0, 0, 0.0, 0.0])
+            tag_stats[0] += 1
+            tag_stats[1] += len(queries)
+            tag_stats[2] += sum(float(query['time']) for query in queries)
+            tag_stats[3] += elapsed
+    return instrumented_render
+
+
+def instrument_compile_func(name, compile_func):
+    def instrumented_compile_func(parser, token):
+        node = compile_func(parser, token)
+        node.render = instrument_render(name, node.render)
+        return node
+    instrumented_compile_func.instrumented = True
+    return instrumented_compile_func
+
+
+def instrument_library(library, names=None):
+    """
+    Instrument the tags of a template library, or only those in 'names'.
+    Must be done before any template loading the library is compiled.
+    """
+    for name in names or list(library.tags):
+        compile_func = library.tags[name]
+        if not getattr(compile_func, 'instrumented', False):
+            library.tags[name] = instrument_compile_func(name, compile_func)
+
+
+def instrument_tags():
+    from wagtail.wagtailcore.templatetags import wagtailcore_tags
+    from wagtail.wagtailimages.templatetags import wagtailimages_tags
+
+    from tbx.core.templatetags import torchbox_tags
+
+    instrument_library(torchbox_tags.register)
+    instrument_library(wagtailcore_tags.register, ['pageurl'])
+    instrument_library(wagtailimages_tags.register, ['image'])
+
+
+def format_stats(stats):
+    return '; '.join(
+        '%s calls=%d queries=%d sql=%.1fms time=%.1fms' % (
+            name, calls, queries, query_time * 1000, elapsed * 1000
+        )
+        for name, (calls, queries, query_time, elapsed)
+        in sorted(stats.items(), key=lambda item: -item[1][3])
+    )
+
+
+def format_server_timing(stats):
+    return ', '.join(
+        'tag-%s;dur=%.1f;desc="%d calls, %d queries, %.1fms SQL"' % (
+            name, elapsed * 1000, calls, queries, query_time * 1000
+        )
+        for name, (calls, queries, query_time, elapsed)
+        in sorted(stats.items(), key=lambda item: -item[1][3])
+    )
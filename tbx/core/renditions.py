@@ -0,0 +1,130 @@
+import logging
+
+from collections import defaultdict
+
+from wagtail.wagtailimages.models import (Filter, SourceImageIOError,
+                                          get_image_model)
+
+from tbx.core.blocks import BulkStreamField, collect_chooser_ids
+
+
+logger = logging.getLogger('tbx.renditions')
+
+
+# Filter specs used by our templates for content images, which the
+# pregenerate_renditions command creates ahead of time for new images and
+# newly published pages
+PREGENERATE_FILTER_SPECS = [
+    # includes/streamfield.html and the og:/twitter: images in base.html
+    'width-400',
+    'width-800',
+    'width-1024',
+    'width-1280',
+    # Blog author avatars
+    'fill-300x300',
+    # Previous/next thumbnails
+    'fill-80x80',
+    # Blog listings and the team page
+    'fill-1200x700',
+    'fill-400x400',
+]
+
+
+def prefetch_renditions(images_and_specs):
+    """
+    Given an iterable of (image, filter spec) pairs, load every existing
+    rendition among them with a single query and attach them to the image
+    instances, so that TorchboxImage.get_rendition() (and therefore the
+    {% image %} tag) doesn't need to query for them.
+
+    Renditions that don't exist yet are left to get_rendition() to create
+    as usual.
+    """
+    images = defaultdict(list)
+    specs = set()
+    for image, spec in images_and_specs:
+        if image is None:
+            continue
+        if not hasattr(image, 'prefetched_renditions'):
+            image.prefetched_renditions = {}
+        images[image.pk].append(image)
+        specs.add(spec)
+
+    if not images:
+        return
+
+    filters = {spec: Filter(spec=spec) for spec in specs}
+    Rendition = get_image_model().get_rendition_model()
+    renditions = Rendition.objects.filter(
+        image_id__in=images.keys(),
+        filter__spec__in=specs,
+    ).select_related('filter')
+
+    for rendition in renditions:
+        spec = rendition.filter.spec
+        for image in images[rendition.image_id]:
+            # Only use the rendition if it was made with the image's
+            # current focal point
+            if rendition.focal_point_key == filters[spec].get_cache_key(image):
+                rendition.image = image
+                image.prefetched_renditions[spec] = rendition
+
+
+# Pregeneration
+
+def pregenerate_image_renditions(image_ids, specs=None):
+    """
+    Create any missing renditions of the given images. Returns the number
+    of renditions created.
+    """
+    specs = specs or PREGENERATE_FILTER_SPECS
+    images = list(get_image_model().objects.filter(pk__in=image_ids))
+    prefetch_renditions(
+        (image, spec) for image in images for spec in specs
+    )
+
+    # get_rendition() also returns renditions created elsewhere since they
+    # were prefetched, so count the rows actually added
+    renditions = get_image_model().get_rendition_model().objects.filter(
+        image_id__in=[image.pk for image in images]
+    )
+    existing = renditions.count()
+
+    for image in images:
+        for spec in specs:
+            if spec in image.prefetched_renditions:
+                continue
+            try:
+                image.get_rendition(spec)
+            except SourceImageIOError:
+                logger.warning("Image file missing: id=%d", image.pk)
+                break
+    return renditions.count() - existing
+
+
+def run_pregeneration(image_ids):
+    """
+    Pool worker entry point: pregenerate renditions, logging any errors
+    rather than passing them back to the parent process.
+    """
+    try:
+        return pregenerate_image_renditions(image_ids)
+    except Exception:
+        logger.exception("Rendition pregeneration failed for images %r", image_ids)
+
+
+def get_page_image_ids(page):
+    """
+    Return the ids of the images a page uses directly, through image
+    foreign keys and ImageChooserBlocks in its StreamFields.
+    """
+    Image = get_image_model()
+    ids = defaultdict(set)
+    for field in page._meta.concrete_fields:
+        if field.is_relation and field.related_model is Image:
+            ids['image'].add(getattr(page, field.attname))
+        elif isinstance(field, BulkStreamField):
+            value = getattr(page, field.name)
+            if value.is_lazy:
+                collect_chooser_ids(value.stream_block, value.stream_data, ids)
+    return ids['image']
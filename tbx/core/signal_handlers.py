@@ -0,0 +1,311 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from wagtail.wagtailcore.models import Page, PageViewRestriction, Site
+from wagtail.wagtailcore.signals import page_published, page_unpublished
+from wagtail.wagtailsearch.index import class_is_indexed
+
+from tbx.core.ancestors import clear_local_entries, invalidate_ancestors
+from tbx.core.cache import bump_generation, bump_model_generations
+from tbx.core.dependencies import (instance_dependency, model_dependency,
+                                   purge_dependents, record_instance)
+from tbx.core.menu import invalidate_main_menu, page_affects_main_menu
+from tbx.core.models import (BlogPage, BlogPageTagList, BlogPageTagSelect,
+                             GlobalSettings, IndexChange, MainMenu,
+                             PageChange, PendingRendition, PersonPage,
+                             TorchboxImage)
+from tbx.core.renditions import get_page_image_ids
+from tbx.core.utils import invalidate_play_paths
+
+
+# Play section index
+# Page.move() saves the moved page, so post_save covers moves as well as
+# new pages and edits to 'show_in_play_menu'. Saving a draft revision only
+# updates fields the index doesn't use, so it leaves cached listings alone.
+
+PLAY_PATHS_FIELDS = frozenset(['path', 'show_in_play_menu', 'live'])
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def play_paths_page_published(sender, instance, **kwargs):
+    invalidate_play_paths()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def play_paths_page_changed(sender, instance, update_fields=None, **kwargs):
+    if not isinstance(instance, Page):
+        return
+    if update_fields is not None and not PLAY_PATHS_FIELDS & set(update_fields):
+        return
+    invalidate_play_paths()
+
+
+# Ancestor chains
+# Page.move() and renames save the page with all its fields, while saving a
+# draft revision only updates a few fields that entries don't hold.
+
+ANCESTOR_ENTRY_FIELDS = frozenset([
+    'title', 'slug', 'url_path', 'path', 'depth', 'show_in_play_menu',
+])
+
+
+@receiver(request_started)
+def ancestors_request_started(sender, **kwargs):
+    clear_local_entries()
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def ancestors_page_published(sender, instance, **kwargs):
+    invalidate_ancestors()
+
+
+@receiver(post_save)
+def ancestors_page_saved(sender, instance, update_fields=None, **kwargs):
+    if isinstance(instance, Page) and (
+        update_fields is None or ANCESTOR_ENTRY_FIELDS.intersection(update_fields)
+    ):
+        invalidate_ancestors()
+
+
+@receiver(post_delete)
+def ancestors_page_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        invalidate_ancestors()
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def ancestors_site_changed(sender, instance, **kwargs):
+    invalidate_ancestors()
+
+
+# Cached results
+# Pages only change what visitors see when published, other models when
+# saved.
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def cached_results_page_published(sender, instance, **kwargs):
+    bump_model_generations(sender)
+
+
+@receiver(post_save)
+def cached_results_instance_saved(sender, instance, **kwargs):
+    if not isinstance(instance, Page):
+        bump_model_generations(sender)
+
+
+@receiver(post_delete)
+def cached_results_instance_deleted(sender, instance, **kwargs):
+    bump_model_generations(sender)
+
+
+# People listings
+
+@receiver(page_published, sender=PersonPage)
+@receiver(page_unpublished, sender=PersonPage)
+@receiver(post_delete, sender=PersonPage)
+def people_person_page_changed(sender, instance, **kwargs):
+    bump_generation('homepage-people')
+    bump_generation('person-index')
+
+
+# Adding or removing a view restriction changes which people are public
+@receiver(post_save, sender=PageViewRestriction)
+@receiver(post_delete, sender=PageViewRestriction)
+def people_view_restriction_changed(sender, instance, **kwargs):
+    bump_generation('homepage-people')
+    bump_generation('person-index')
+
+
+# Main menu
+
+@receiver(post_save, sender=MainMenu)
+def main_menu_saved(sender, instance, **kwargs):
+    invalidate_main_menu()
+
+
+# Fields of a page that the menu shows or that change its URL. Draft and
+# revision saves only update other fields.
+MAIN_MENU_PAGE_FIELDS = frozenset(['title', 'slug', 'live', 'path', 'url_path'])
+
+
+def main_menu_page_changed(page):
+    affects_menu = page_affects_main_menu(page)
+    if affects_menu is None:
+        # Nothing is known about the cached menus, so drop them, but don't
+        # purge every page that shows a menu
+        invalidate_main_menu()
+    elif affects_menu:
+        invalidate_main_menu()
+        purge_dependents([model_dependency(MainMenu)])
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def main_menu_page_published(sender, instance, **kwargs):
+    main_menu_page_changed(instance)
+
+
+@receiver(post_save)
+def main_menu_page_saved(sender, instance, update_fields=None, **kwargs):
+    if isinstance(instance, Page) and (
+        update_fields is None or MAIN_MENU_PAGE_FIELDS.intersection(update_fields)
+    ):
+        main_menu_page_changed(instance)
+
+
+@receiver(post_delete)
+def main_menu_page_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        main_menu_page_changed(instance)
+
+
+# Rendition pregeneration
+# Images are queued here, in the same transaction as the change, and their
+# renditions created by the pregenerate_renditions command.
+
+@receiver(post_save, sender=TorchboxImage)
+def pregenerate_image_saved(sender, instance, update_fields=None, **kwargs):
+    # Partial saves only touch metadata, not the file or focal point
+    if update_fields is None and settings.PREGENERATE_RENDITIONS:
+        PendingRendition.add([instance.pk])
+
+
+@receiver(page_published)
+def pregenerate_page_published(sender, instance, **kwargs):
+    if settings.PREGENERATE_RENDITIONS:
+        PendingRendition.add(get_page_image_ids(instance))
+
+
+# Feeds
+
+@receiver(page_published, sender=BlogPage)
+@receiver(page_unpublished, sender=BlogPage)
+@receiver(post_delete, sender=BlogPage)
+def feeds_blog_page_changed(sender, instance, **kwargs):
+    bump_generation('feeds')
+
+
+# Blog previous/next links
+
+@receiver(page_published, sender=BlogPage)
+@receiver(page_unpublished, sender=BlogPage)
+@receiver(post_delete, sender=BlogPage)
+def blog_neighbours_blog_page_changed(sender, instance, **kwargs):
+    # The posts either side of this one, before and after the change, link
+    # to it or now link past it
+    neighbour_ids = set(instance.get_neighbour_ids().values())
+    neighbour_ids.update((instance.get_cached_neighbour_ids() or {}).values())
+    purge_dependents([
+        'blog-neighbours:%d' % pk for pk in neighbour_ids if pk is not None
+    ])
+    bump_generation('blog-neighbours')
+
+
+# Blog index listing fragments
+
+@receiver(page_published, sender=BlogPage)
+@receiver(page_unpublished, sender=BlogPage)
+@receiver(post_delete, sender=BlogPage)
+def blog_listing_blog_page_changed(sender, instance, **kwargs):
+    bump_generation('blog-listing')
+
+
+# Blog tag usage counts
+# Publishing saves the page's tag rows, deleting any that were removed, so
+# tags dropped from a page are recounted by the post_delete receiver.
+
+@receiver(page_published, sender=BlogPage)
+@receiver(page_unpublished, sender=BlogPage)
+def tag_counts_blog_page_changed(sender, instance, **kwargs):
+    BlogPageTagList.update_usage_counts(
+        BlogPageTagSelect.objects.filter(page=instance).values_list('tag', flat=True)
+    )
+
+
+@receiver(post_delete, sender=BlogPageTagSelect)
+def tag_counts_tag_select_deleted(sender, instance, **kwargs):
+    BlogPageTagList.update_usage_counts([instance.tag_id])
+
+
+# Page cache and frontend cache purging
+# Only the URLs that depend on the page, or on its type through a listing,
+# are purged (see tbx.core.dependencies).
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def purge_page_published(sender, instance, **kwargs):
+    purge_dependents([instance_dependency(instance), model_dependency(sender)])
+
+
+@receiver(post_delete)
+def purge_page_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        purge_dependents([instance_dependency(instance), model_dependency(sender)])
+
+
+@receiver(post_save, sender=TorchboxImage)
+def purge_image_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None:
+        purge_dependents([instance_dependency(instance)])
+
+
+@receiver(post_save, sender=MainMenu)
+@receiver(post_save, sender=GlobalSettings)
+def purge_settings_saved(sender, instance, **kwargs):
+    purge_dependents([model_dependency(sender)])
+
+
+# Dependency recording
+
+@receiver(post_init)
+def record_instance_loaded(sender, instance, **kwargs):
+    record_instance(instance)
+
+
+# Page change log
+# Publishing, unpublishing, expiring and moving a page all do a full save,
+# unlike saving a draft.
+
+@receiver(post_save)
+def page_change_page_saved(sender, instance, update_fields=None, **kwargs):
+    if settings.PRERENDER_ROOT and update_fields is None and isinstance(instance, Page):
+        PageChange.record(instance)
+
+
+@receiver(post_delete)
+def page_change_page_deleted(sender, instance, **kwargs):
+    if settings.PRERENDER_ROOT and isinstance(instance, Page):
+        PageChange.record(instance)
+
+
+# Search index change log
+# Partial saves of pages are draft revisions, locking and moderation, which
+# don't change what's indexed: the live content is only saved in full.
+
+def index_change_fields_changed(instance, update_fields):
+    if update_fields is None:
+        return True
+    if isinstance(instance, Page):
+        return False
+    indexed_fields = set(field.field_name for field in instance.get_search_fields())
+    return bool(indexed_fields.intersection(update_fields))
+
+
+@receiver(post_save)
+def index_change_object_saved(sender, instance, update_fields=None, **kwargs):
+    if class_is_indexed(sender) and index_change_fields_changed(instance, update_fields):
+        IndexChange.record(instance)
+        bump_generation('search')
+
+
+@receiver(post_delete)
+def index_change_object_deleted(sender, instance, **kwargs):
+    if class_is_indexed(sender):
+        IndexChange.record(instance)
+        bump_generation('search')
@@ -1 +1 @@
-$(function(){$(document).on("click",".next",function(n){n.preventDefault(),$.scrollTo($("section.blog"),1e3),$("#listing").load(blog_page,next_params,function(){})}),$(document).on("click",".previous",function(n){n.preventDefault(),$.scrollTo($("section.blog"),1e3),$("#listing").load(blog_page,prev_params,function(){})})});
\ No newline at end of file
+$(function(){$(document).on("click","#listing .next a, #listing .previous a",function(n){n.preventDefault(),$.scrollTo($("section.blog"),1e3),$("#listing").load($(this).attr("href"))})});
\ No newline at end of file
@@ -1,17 +1,8 @@
 $(function() {
-	$(document).on('click', '.next', function(e){
+	// The blog index returns just its listing for ajax requests
+	$(document).on('click', '#listing .next a, #listing .previous a', function(e){
 		e.preventDefault();
 		$.scrollTo($('section.blog'), 1000);
-		$('#listing').load(blog_page, next_params, function(){
-			
-		});
-	});
-
-	$(document).on('click', '.previous', function(e){
-		e.preventDefault();
-		$.scrollTo($('section.blog'), 1000);
-		$('#listing').load(blog_page, prev_params, function(){
-			
-		});
+		$('#listing').load($(this).attr('href'));
 	});
 });
\ No newline at end of file
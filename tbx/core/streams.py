@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+
+import heapq
+
+from datetime import date, datetime
+from itertools import islice
+
+from django.db.models import Q
+from django.utils import timezone
+
+from tbx.core.dependencies import record_model
+
+
+# Content streams
+#
+# A content stream merges pages of several types into a single list, newest
+# first. Each type is read from its own queryset in small keyset-paginated
+# chunks, ordered by (date, id), and the chunks are combined with a k-way
+# merge, so only as many rows are fetched from each type as actually make
+# it into the stream.
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _sort_key(value, pk):
+    # heapq.merge() only merges in ascending order on Python 2, so sort on
+    # negated seconds. DateFields and DateTimeFields are compared on the
+    # same scale, in the current time zone.
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+    elif isinstance(value, date):
+        value = datetime.combine(value, datetime.min.time())
+    return (-(value - EPOCH).total_seconds(), -pk)
+
+
+class StreamSource(object):
+    """
+    A queryset of pages to include in a ContentStream, sorted on
+    'date_field'. Sources with a 'tag_lookup' (the lookup matching a tag
+    slug, such as 'tags__tag__slug') can be filtered by tag; sources
+    without one are left out of tag filtered streams.
+    """
+    def __init__(self, queryset, date_field, tag_lookup=None):
+        self.queryset = queryset
+        self.date_field = date_field
+        self.tag_lookup = tag_lookup
+
+    def get_queryset(self, tag=None, exclude=None):
+        queryset = self.queryset.filter(**{self.date_field + '__isnull': False})
+        if tag is not None:
+            queryset = queryset.filter(**{self.tag_lookup: tag}).distinct()
+        if exclude:
+            queryset = queryset.exclude(pk__in=exclude)
+        return queryset.order_by('-' + self.date_field, '-pk')
+
+    def iter_items(self, chunk_size, tag=None, exclude=None):
+        """
+        Yield (sort key, page) pairs, fetching 'chunk_size' pages at a time.
+        Each chunk starts after the last page of the previous one.
+        """
+        queryset = self.get_queryset(tag=tag, exclude=exclude)
+        chunk = queryset
+        while True:
+            pages = list(chunk[:chunk_size])
+            for page in pages:
+                yield _sort_key(getattr(page, self.date_field), page.pk), page
+            if len(pages) < chunk_size:
+                return
+
+            last_date = getattr(pages[-1], self.date_field)
+            chunk = queryset.filter(
+                Q(**{self.date_field + '__lt': last_date}) |
+                Q(**{self.date_field: last_date, 'pk__lt': pages[-1].pk})
+            )
+
+
+class ContentStream(object):
+    """
+    Pages from several StreamSources, newest first.
+
+        stream = ContentStream([
+            StreamSource(BlogPage.objects.live(), 'date', 'tags__tag__slug'),
+            StreamSource(PersonPage.objects.live(), 'first_published_at'),
+        ])
+        latest = stream.items(10, exclude=featured_ids)
+    """
+    def __init__(self, sources):
+        self.sources = sources
+
+    def iter_items(self, chunk_size=10, tag=None, exclude=None):
+        sources = [
+            source for source in self.sources
+            if tag is None or source.tag_lookup is not None
+        ]
+        for source in sources:
+            record_model(source.queryset.model)
+
+        merged = heapq.merge(*[
+            source.iter_items(chunk_size, tag=tag, exclude=exclude)
+            for source in sources
+        ])
+        for key, page in merged:
+            yield page
+
+    def items(self, count, tag=None, exclude=None):
+        """
+        Return a list of the newest 'count' pages, optionally only those
+        tagged with the slug 'tag' and leaving out pages whose ids are in
+        'exclude'.
+        """
+        if count <= 0:
+            return []
+        return list(islice(
+            self.iter_items(chunk_size=count, tag=tag, exclude=exclude),
+            count
+        ))
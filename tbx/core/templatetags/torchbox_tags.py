@@ -1,7 +1,15 @@
 from django import template
 from django.conf import settings
 
+from wagtail.wagtailcore.models import Site
+
+from tbx.core.ancestors import get_ancestor_entries, get_entry_url
+from tbx.core.cache import cached_result
+from tbx.core.dependencies import record, record_model, record_page
+from tbx.core.menu import render_main_menu
 from tbx.core.models import *
+from tbx.core.renditions import prefetch_renditions
+from tbx.core.streams import ContentStream, StreamSource
 from tbx.core.utils import *
 
 register = template.Library()
@@ -39,16 +47,12 @@ def get_prev_sibling_by_order(page):
 
 @register.assignment_tag
 def get_next_sibling_blog(page):
-    sibling = BlogPage.objects.filter(date__lt=page.date).order_by('-date').live().first()
-    if sibling:
-        return sibling.specific
+    return page.blog_neighbours['next']
 
 
 @register.assignment_tag
 def get_prev_sibling_blog(page):
-    sibling = BlogPage.objects.filter(date__gt=page.date).order_by('-date').live().last()
-    if sibling:
-        return sibling.specific
+    return page.blog_neighbours['prev']
 
 
 @register.assignment_tag(takes_context=True)
@@ -56,6 +60,19 @@ def get_site_root(context):
     return context['request'].site.root_page
 
 
+# Ancestors for breadcrumbs, from the ancestor cache
+@register.assignment_tag(takes_context=True)
+def get_breadcrumb_ancestors(context, page):
+    site = context['request'].site
+    ancestors = [
+        dict(entry, url=get_entry_url(entry, site))
+        for entry in get_ancestor_entries(page)
+    ]
+    # Only ancestors below the homepage have their titles shown
+    record(*['page:%d' % entry['id'] for entry in ancestors if entry['depth'] > 2])
+    return ancestors
+
+
 @register.filter
 def content_type(value):
     # marketing landing page should behave like the homepage in templates
@@ -69,16 +86,43 @@ def in_play(page):
     return is_in_play(page)
 
 
+@register.simple_tag
+def prefetch_story_renditions(value):
+    """
+    Load the renditions a StoryBlock stream needs in a single query
+    before it is rendered.
+    """
+    prefetch_renditions(value.stream_block.get_rendition_specs(value))
+    return ''
+
+
 @register.simple_tag
 def main_menu():
     return MainMenu.objects.first()
 
 
+@register.simple_tag(takes_context=True)
+def cached_main_menu(context):
+    # request.site is None on hosts that match no site, such as on 404
+    # pages for unknown hosts
+    site = getattr(context.get('request'), 'site', None)
+    if site is None:
+        site = Site.objects.filter(is_default_site=True).first()
+        if site is None:
+            return ''
+    return render_main_menu(site)
+
+
 # Person feed for home page
 @register.inclusion_tag('torchbox/tags/homepage_people_listing.html', takes_context=True)
 def homepage_people_listing(context, count=3):
-    people = play_filter(PersonPage.objects.filter(live=True).order_by('?'),
-                         count)
+    record_model(PersonPage)
+    people = PersonPage.objects.live().not_in_play().select_related(
+        'image'
+    ).sample(count, 'homepage-people')
+    # A different sample is shown on each request, so the page isn't
+    # pre-rendered (see tbx.core.prerender)
+    context['request'].varies_per_request = True
     return {
         'people': people,
         # required by the pageurl tag that we want to use within this template
@@ -87,9 +131,19 @@ def homepage_people_listing(context, count=3):
 
 
 # Blog feed for home page
+@cached_result('homepage-blog-posts', models=[BlogPage], local_size=8,
+               generations=['play-paths'])
+def get_homepage_blog_post_ids(count):
+    return list(
+        BlogPage.objects.live().not_in_play().order_by('-date')
+        .values_list('pk', flat=True)[:count]
+    )
+
+
 @register.inclusion_tag('torchbox/tags/homepage_blog_listing.html', takes_context=True)
 def homepage_blog_listing(context, count=6):
-    blog_posts = play_filter(BlogPage.objects.filter(live=True).order_by('-date'), count)
+    record_model(BlogPage)
+    blog_posts = BlogPage.objects.live().in_order(get_homepage_blog_post_ids(count))
     return {
         'blog_posts': blog_posts,
         # required by the pageurl tag that we want to use within this template
@@ -110,16 +164,32 @@ def homepage_blog_listing(context, count=6):
 
 
 # Jobs feed for home page
+@cached_result('homepage-jobs', models=[JobIndexPage], local_size=8)
+def get_homepage_job_ids(count):
+    """
+    Return the id of the job index page and the ids of its first 'count'
+    jobs, or (None, []) if there is no live job index page.
+    """
+    # Assume there is only one job index page
+    jobindex_id = JobIndexPage.objects.live().values_list('pk', flat=True).first()
+    if jobindex_id is None:
+        return None, []
+    jobs = JobIndexPageJob.objects.filter(page_id=jobindex_id).values_list('pk', flat=True)
+    if count:
+        jobs = jobs[:count]
+    return jobindex_id, list(jobs)
+
+
 @register.inclusion_tag('torchbox/tags/homepage_job_listing.html', takes_context=True)
 def homepage_job_listing(context, count=3, intro_text=None):
-    # Assume there is only one job index page
-    jobindex = JobIndexPage.objects.filter(live=True).first()
-    if jobindex:
-        jobs = jobindex.job.all()
-        if count:
-            jobs = jobs[:count]
-    else:
-        jobs = []
+    jobindex_id, job_ids = get_homepage_job_ids(count)
+    jobindex = None
+    jobs = []
+    if jobindex_id is not None:
+        jobindex = JobIndexPage.objects.live().filter(pk=jobindex_id).first()
+        jobs = JobIndexPageJob.objects.in_bulk(job_ids)
+        jobs = [jobs[pk] for pk in job_ids if pk in jobs]
+        record_page(jobindex)
     jobintro = intro_text or jobindex and jobindex.listing_intro
     return {
         'jobintro': jobintro,
@@ -140,9 +210,19 @@ def homepage_job_listing(context, count=3, intro_text=None):
 #
 
 # blog posts by team member
+@cached_result('person-blog-posts', models=[BlogPage], local_size=32,
+               generations=['play-paths'])
+def get_person_blog_post_ids(person_id):
+    return list(
+        BlogPage.objects.filter(related_author__author=person_id)
+        .live().not_in_play().order_by('-date').values_list('pk', flat=True)
+    )
+
+
 @register.inclusion_tag('torchbox/tags/person_blog_listing.html', takes_context=True)
 def person_blog_post_listing(context, calling_page=None):
-    posts = play_filter(BlogPage.objects.filter(related_author__author=calling_page.id).live().order_by('-date'))
+    record_model(BlogPage)
+    posts = BlogPage.objects.live().in_order(get_person_blog_post_ids(calling_page.id))
     return {
         'posts': posts,
         'calling_page': calling_page,
@@ -151,13 +231,22 @@ def person_blog_post_listing(context, calling_page=None):
     }
 
 
+def get_work_and_blog_stream():
+    # Work pages will be added here as another StreamSource
+    return ContentStream([
+        StreamSource(
+            BlogPage.objects.live().not_in_play(), 'date',
+            tag_lookup='tags__tag__slug'
+        ),
+    ])
+
+
 @register.inclusion_tag('torchbox/tags/work_and_blog_listing.html', takes_context=True)
 def work_and_blog_listing(context, count=10, marketing=False):
     """
-    An interleaved list of work and blog items.
+    An interleaved list of work and blog items, newest first.
     """
-    blog_posts = BlogPage.objects.filter(live=True)
-    works = None # WorkPage.objects.filter(live=True)
+    stream = get_work_and_blog_stream()
     if marketing:
         featured_items = context['page'].featured_items.all()
 
@@ -166,26 +255,18 @@ def work_and_blog_listing(context, count=10, marketing=False):
 
         # For marketing landing page return only posts and works
         # tagged with "digital_marketing"
-        featured_items_ids = featured_items.values_list('related_page_id', flat=True)
-        filter_tag = "digital_marketing"
-        blog_posts = blog_posts.filter(tags__tag__slug=filter_tag).exclude(pk__in=featured_items_ids)
-        works = works.filter(tags__tag__slug=filter_tag).exclude(pk__in=featured_items_ids)
+        items = stream.items(
+            count,
+            tag="digital_marketing",
+            exclude=[item.related_page_id for item in featured_items],
+        )
     else:
-        # For normal case, do not display "marketing_only" posts and works
-        blog_posts = blog_posts.exclude(marketing_only=True)
-        works = works.exclude(marketing_only=True)
         featured_items = []
-
-    # If (remaining) count is odd, blog_count = work_count + 1
-    blog_count = (count + 1) / 2
-    work_count = count / 2
-
-    blog_posts = play_filter(blog_posts.order_by('-date'), blog_count)
-    works = play_filter(works.order_by('-pk'), work_count)
+        items = stream.items(count)
 
     return {
         'featured_items': featured_items,
-        'items': list(roundrobin(blog_posts, works)),
+        'items': items,
         # required by the pageurl tag that we want to use within this template
         'request': context['request'],
     }
@@ -1,12 +1,15 @@
 from django.conf.urls import url
 
-from tbx.core.feeds import BlogFeed, PlanetDrupalFeed
+from tbx.core import views
+from tbx.core.feeds import BlogFeed, EventsFeed, PlanetDrupalFeed
 
 urlpatterns = [
+    url(r'^search/$', views.search, name='search'),
     url(r'^blog/feed/$', BlogFeed(), name='blog_feed'),
     url(
         r'^blog/feed/planet_drupal/$',
         PlanetDrupalFeed(),
         name='planet_drupal_feed'
     ),
+    url(r'^events/feed/$', EventsFeed(), name='events_feed'),
 ]
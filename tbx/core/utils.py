@@ -1,7 +1,9 @@
-import hashlib
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
 
-from datetime import datetime, time, timedelta
-from itertools import chain, cycle, islice
+from tbx.core.cache import bump_generation
+from tbx.core.ical import iter_calendar
 
 
 def export_event(event, format='ical'):
@@ -9,74 +11,71 @@ def export_event(event, format='ical'):
     if format != 'ical':
         return
 
-    # Begin event
-    # VEVENT format: http://www.kanzaki.com/docs/ical/vevent.html
-    ical_components = [
-        'BEGIN:VCALENDAR',
-        'VERSION:2.0',
-        'PRODID:-//Torchbox//wagtail//EN',
-    ]
-
-    # Work out number of days the event lasts
-    if event.date_to is not None:
-        days = (event.date_to - event.date_from).days + 1
-    else:
-        days = 1
-
-    for day in range(days):
-        # Get date
-        date = event.date_from + timedelta(days=day)
-
-        # Get times
-        if event.time_from is not None:
-            start_time = event.time_from
-        else:
-            start_time = datetime.time.min
-        if event.time_to is not None:
-            end_time = event.time_to
-        else:
-            end_time = time.max
-
-        # Combine dates and times
-        start_datetime = datetime.combine(
-            date,
-            start_time
+    return ''.join(iter_calendar([event]))
+
+
+PLAY_PATHS_CACHE_KEY = 'tbx:play-paths'
+
+
+def build_play_paths():
+    """
+    Build the Play section index: the treebeard paths of every page that
+    has 'show_in_play_menu' set to True. Paths nested inside another Play
+    section are dropped, as the outer prefix already covers them.
+    """
+    from wagtail.wagtailcore.models import get_page_models
+
+    paths = set()
+    for model in get_page_models():
+        try:
+            field = model._meta.get_field('show_in_play_menu')
+        except FieldDoesNotExist:
+            continue
+
+        # Only query the model that defines the field, not its subclasses
+        if field.model is not model:
+            continue
+
+        paths.update(
+            model.objects.filter(show_in_play_menu=True)
+            .values_list('path', flat=True)
         )
-        end_datetime = datetime.combine(date, end_time)
-
-        def add_slashes(string):
-            string.replace('"', '\\"')
-            string.replace('\\', '\\\\')
-            string.replace(',', '\\,')
-            string.replace(':', '\\:')
-            string.replace(';', '\\;')
-            string.replace('\n', '\\n')
-            return string
-
-        # Make a uid
-        uid = hashlib.sha1(event.url + str(start_datetime)).hexdigest() + '@wagtaildemo'
-
-        # Make event
-        ical_components.extend([
-            'BEGIN:VEVENT',
-            'UID:' + add_slashes(uid),
-            'URL:' + add_slashes(event.url),
-            'DTSTAMP:' + start_time.strftime('%Y%m%dT%H%M%S'),
-            'SUMMARY:' + add_slashes(event.title),
-            'DESCRIPTION:' + add_slashes(event.search_description),
-            'LOCATION:' + add_slashes(event.location),
-            'DTSTART;TZID=Europe/London:' + start_datetime.strftime('%Y%m%dT%H%M%S'),
-            'DTEND;TZID=Europe/London:' + end_datetime.strftime('%Y%m%dT%H%M%S'),
-            'END:VEVENT',
-        ])
-
-    # Finish event
-    ical_components.extend([
-        'END:VCALENDAR',
-    ])
-
-    # Join components
-    return '\r'.join(ical_components)
+
+    prefixes = []
+    for path in sorted(paths):
+        if not prefixes or not path.startswith(prefixes[-1]):
+            prefixes.append(path)
+    return tuple(prefixes)
+
+
+def get_play_paths():
+    """
+    Return the cached Play section index, building it if needed. The
+    index is invalidated whenever a page is published, unpublished,
+    moved or deleted (see tbx.core.signal_handlers).
+    """
+    paths = cache.get(PLAY_PATHS_CACHE_KEY)
+    if paths is None:
+        paths = build_play_paths()
+        cache.set(PLAY_PATHS_CACHE_KEY, paths, None)
+    return paths
+
+
+def invalidate_play_paths():
+    cache.delete(PLAY_PATHS_CACHE_KEY)
+    # Cached results that leave out the Play section
+    bump_generation('play-paths')
+
+
+def play_path_q():
+    """
+    Return a Q object matching pages in the Play section, or an empty Q
+    if there are no Play sections.
+    """
+    q = Q()
+    for path in get_play_paths():
+        q |= Q(path__startswith=path)
+    return q
 
 
 def is_in_play(page):
@@ -88,19 +87,14 @@ def is_in_play(page):
     if not page:
         return False
 
-    if getattr(page.specific, 'show_in_play_menu', False):
-        return True
-
-    return any(
-        getattr(ancestor.specific, 'show_in_play_menu', False)
-        for ancestor in page.get_ancestors()
-    )
+    return page.path.startswith(get_play_paths())
 
 
 def play_filter(pages, number=None):
     """
     Given an iterable of Pages, return a specified number that
-    are not in the Play section.
+    are not in the Play section. For querysets of BlogPage or PersonPage
+    use .not_in_play() instead, which filters in the database.
     """
     result = []
     for page in pages:
@@ -109,18 +103,3 @@ def play_filter(pages, number=None):
         if not is_in_play(page):
             result.append(page)
     return result
-
-
-# https://docs.python.org/2/library/itertools.html#recipes
-def roundrobin(*iterables):
-    "roundrobin('ABC', 'D', 'EF') --> A D E B F C"
-    # Recipe credited to George Sakkis
-    pending = len(iterables)
-    nexts = cycle(iter(it).next for it in iterables)
-    while pending:
-        try:
-            for next in nexts:
-                yield next()
-        except StopIteration:
-            pending -= 1
-            nexts = cycle(islice(nexts, pending))
@@ -0,0 +1,72 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+from django.utils.encoding import force_bytes
+
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailsearch.models import Query
+
+from tbx.core.cache import make_key
+
+
+SEARCH_RESULTS_PER_PAGE = 20
+
+
+def get_search_result_ids(query_string, page_number):
+    """
+    Return the ids of one page of search results, best match first, and the
+    total number of results. Results are cached per normalised query and
+    page until the search index changes or SEARCH_CACHE_TIMEOUT passes.
+    """
+    normalised = ' '.join(query_string.lower().split())
+    key = make_key('search', md5(force_bytes(normalised)).hexdigest(), page_number)
+    cached = cache.get(key)
+    if cached is None:
+        results = Page.objects.live().search(normalised)
+        start = (page_number - 1) * SEARCH_RESULTS_PER_PAGE
+        cached = (
+            [page.pk for page in results[start:start + SEARCH_RESULTS_PER_PAGE]],
+            results.count(),
+        )
+        cache.set(key, cached, settings.SEARCH_CACHE_TIMEOUT)
+    return cached
+
+
+def load_search_results(ids):
+    """
+    Load the pages with the given ids as their specific types, with one
+    query per type, keeping the order of 'ids'.
+    """
+    pages = Page.objects.filter(pk__in=ids).specific()
+    pages = dict((page.pk, page) for page in pages)
+    return [pages[pk] for pk in ids if pk in pages]
+
+
+def search(request):
+    query_string = request.GET.get('q', '').strip()
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_number = 1
+
+    query = None
+    search_results = []
+    count = 0
+    if query_string:
+        query = Query.get(query_string)
+        query.add_hit()
+
+        ids, count = get_search_result_ids(query_string, page_number)
+        search_results = load_search_results(ids)
+
+    return render(request, 'torchbox/search_results.html', {
+        'query_string': query_string,
+        'query': query,
+        'search_results': search_results,
+        'count': count,
+        'page_number': page_number,
+        'has_previous': page_number > 1,
+        'has_next': count > page_number * SEARCH_RESULTS_PER_PAGE,
+    })
@@ -6,6 +6,14 @@ from wagtail.wagtailcore.whitelist import allow_without_attributes
 
 from wagtailmodeladmin.options import ModelAdminGroup, ModelAdmin, wagtailmodeladmin_register
 
+from tbx.core.dependencies import record_page
+
+
+
+@hooks.register('before_serve_page')
+def record_served_page(page, request, serve_args, serve_kwargs):
+    # The page being served is a render dependency of its own URL
+    record_page(page)
 
 
 @hooks.register('construct_whitelister_element_rules')
@@ -60,6 +60,10 @@ MIDDLEWARE_CLASSES = [
 
     'wagtail.wagtailcore.middleware.SiteMiddleware',
     'wagtail.wagtailredirects.middleware.RedirectMiddleware',
+
+    'tbx.core.middleware.TagProfilingMiddleware',
+    'tbx.core.middleware.PageCacheMiddleware',
+    'tbx.core.middleware.DependencyMiddleware',
 ]
 
 ROOT_URLCONF = 'tbx.urls'
@@ -191,5 +195,47 @@ WAGTAIL_ENABLE_UPDATE_CHECK = False
 # Override the Image class used by wagtailimages with a custom one
 WAGTAILIMAGES_IMAGE_MODEL = 'torchbox.TorchboxImage'
 
+# Whether newly uploaded images and the images of newly published pages are
+# queued for the pregenerate_renditions command. Only enable this where
+# something runs the command regularly, such as a crontab entry like
+#
+#     */5 * * * * dj pregenerate_renditions
+#
+# as nothing else empties the queue. Otherwise renditions are created on
+# demand.
+PREGENERATE_RENDITIONS = False
+
+# Seconds that pages are served to anonymous visitors from the cache before
+# being rendered again. Publishing makes cached pages stale immediately;
+# stale pages are still served for up to PAGE_CACHE_STALE_TIMEOUT seconds
+# while one request renders a fresh copy. Set to 0 to disable the cache.
+PAGE_CACHE_TIMEOUT = 600
+PAGE_CACHE_STALE_TIMEOUT = 24 * 60 * 60
+PAGE_CACHE_LOCK_TIMEOUT = 30
+
+# Seconds that the dependencies of a rendered page are remembered for, to
+# purge it when they change. Should be longer than pages are kept in the
+# page cache, the frontend cache and PRERENDER_ROOT without being rendered
+# again.
+DEPENDENCY_INDEX_TIMEOUT = 7 * 24 * 60 * 60
+
+# Directory that the prerender_site command renders pages to, and that
+# PrerenderedWhiteNoise (see wsgi.py) serves them from to anonymous visitors.
+# None disables serving pre-rendered pages.
+PRERENDER_ROOT = None
+
+# Seconds that the ids of a page of search results are cached for. They are
+# also dropped whenever an indexed object is saved or deleted.
+SEARCH_CACHE_TIMEOUT = 5 * 60
+
+# Seconds that the blog listing fragments loaded by ajax are cached for.
+# They are also dropped whenever a blog page is published or unpublished.
+BLOG_LISTING_CACHE_TIMEOUT = 60 * 60
+
+# Share of requests, from 0 to 1, whose template tags are profiled, with the
+# results logged to the 'tbx.profiling' logger. Staff can profile a single
+# request by sending an X-Tag-Profile header.
+TAG_PROFILING_SAMPLE_RATE = 0
+
 # Facebook JSSDK app Id
 FB_APP_ID = ''
@@ -14,6 +14,17 @@ BASE_URL = 'http://localhost:8000'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+PAGE_CACHE_TIMEOUT = 0
+
+# Search a local SQLite index rather than needing Elasticsearch. Compare the
+# two with ./manage.py benchmark_search
+WAGTAILSEARCH_BACKENDS = {
+    'default': {
+        'BACKEND': 'tbx.core.search',
+        'PATH': os.path.join(BASE_DIR, 'search.sqlite3'),
+    },
+}
+
 
 try:
     from .local import *
@@ -73,6 +73,16 @@ if 'MEDIA_URL' in env:
 if 'MEDIA_DIR' in env:
     MEDIA_ROOT = env['MEDIA_DIR']
 
+if 'PRERENDER_DIR' in env:
+    PRERENDER_ROOT = env['PRERENDER_DIR']
+
+if env.get('PREGENERATE_RENDITIONS') == 'true':
+    # The pregenerate_renditions command must be scheduled too, see base.py
+    PREGENERATE_RENDITIONS = True
+
+if 'TAG_PROFILING_SAMPLE_RATE' in env:
+    TAG_PROFILING_SAMPLE_RATE = float(env['TAG_PROFILING_SAMPLE_RATE'])
+
 STATICFILES_STORAGE='django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 
 # Database
@@ -136,6 +146,17 @@ if 'ELASTICSEARCH_URL' in env:
             'ATOMIC_REBUILD': True,
         },
     }
+elif 'SEARCH_INDEX_PATH' in env:
+    # The local index is a file on each host, and saves only update the
+    # index of the host that handled them, so only use it where the site
+    # runs on a single host. Sites deployed to several hosts (like the live
+    # roles in vb-vga/fabfile.py) need ELASTICSEARCH_URL.
+    WAGTAILSEARCH_BACKENDS = {
+        'default': {
+            'BACKEND': 'tbx.core.search',
+            'PATH': env['SEARCH_INDEX_PATH'],
+        },
+    }
 
 
 # Logging
@@ -192,7 +213,7 @@ if 'LOG_DIR' in env:
         'maxBytes':     5242880, # 5MB
         'backupCount':  5
     }
-    LOGGING['loggers']['wagtail']['handlers'].append('tbx_file')
+    LOGGING['loggers']['tbx']['handlers'].append('tbx_file')
 
     # Wagtail log
     LOGGING['handlers']['wagtail_file'] = {
@@ -9,11 +9,14 @@ https://docs.djangoproject.com/en/1.8/howto/deployment/wsgi/
 
 import os
 
-from whitenoise.django import DjangoWhiteNoise
-
 from django.core.wsgi import get_wsgi_application
 
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tbx.settings.dev")
 
-application = DjangoWhiteNoise(get_wsgi_application())
+django_application = get_wsgi_application()
+
+# Imported once settings are configured
+from tbx.core.prerender import PrerenderedWhiteNoise  # noqa
+
+application = PrerenderedWhiteNoise(django_application)
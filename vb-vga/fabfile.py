@@ -54,7 +54,7 @@ def _deploy():
     run('pip install -r requirements.txt')
     run('dj migrate --noinput')
     run('dj collectstatic --noinput')
-    run('dj update_index')
+    run('dj update_index --incremental')
     run('restart')
 
 